@@ -0,0 +1,84 @@
+import hmac
+import os
+
+from flask import Blueprint, jsonify, request, url_for
+from ml.pose_store import CLIP_EXTENSIONS, IMAGE_EXTENSIONS
+from ml.pro_library import valid_player_name
+from ml.registry import get_calculator
+from werkzeug.utils import secure_filename
+
+# Would be shadowed by the library routes below
+RESERVED_PLAYER_NAMES = {"reload", "status"}
+
+
+def create_admin_bp(updater, token):
+    # Pro library administration; every route needs
+    # "Authorization: Bearer <ADMIN_TOKEN>"
+    admin_bp = Blueprint("admin_bp", __name__)
+
+    @admin_bp.before_request
+    def check_token():
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+            return jsonify({"error": "Unauthorized"}), 401
+
+    @admin_bp.route("/pro-players/<player>", methods=["POST"])
+    def add_reference_files(player):
+        # Multipart "files": reference images or clips for this player. They
+        # are saved right away and ingested in the background; poll the
+        # status URL for the new library generation.
+        player = player.strip()
+        if not valid_player_name(player):
+            return jsonify({"error": "Invalid player name"}), 400
+        if player.lower() in RESERVED_PLAYER_NAMES:
+            return jsonify({"error": f"Player name is reserved: {player}"}), 400
+        files = request.files.getlist("files")
+        if not files:
+            return jsonify({"error": "No files"}), 400
+
+        allowed = IMAGE_EXTENSIONS | CLIP_EXTENSIONS
+        names = []
+        for file in files:
+            name = secure_filename(file.filename or "")
+            if os.path.splitext(name)[1].lower() not in allowed:
+                return jsonify({"error": f"File type not allowed: {file.filename}"}), 400
+            names.append(name)
+
+        for file, name in zip(files, names):
+            updater.save_file(player, name, file.stream)
+        updater.request_update()
+        return (
+            jsonify(
+                {
+                    "message": "Files saved and queued for ingestion",
+                    "player": player,
+                    "files": names,
+                    "status_url": url_for("admin_bp.library_status"),
+                }
+            ),
+            202,
+        )
+
+    @admin_bp.route("/pro-players/reload", methods=["POST"])
+    def reload_library():
+        # Re-scan pro_players, e.g. after files were removed
+        updater.request_update()
+        return jsonify({"message": "Update queued", **updater.status()}), 202
+
+    @admin_bp.route("/pro-players/status", methods=["GET"])
+    def library_status():
+        calculator = get_calculator()
+        return (
+            jsonify(
+                {
+                    **updater.status(),
+                    "serving_generation": calculator.generation,
+                    "players": {
+                        player: len(poses) for player, poses in calculator.pro_poses.items()
+                    },
+                }
+            ),
+            200,
+        )
+
+    return admin_bp
@@ -0,0 +1,26 @@
+from flask import Blueprint, jsonify, request
+
+
+def create_jobs_bp(job_queue, max_wait=30):
+    jobs_bp = Blueprint("jobs_bp", __name__)
+
+    @jobs_bp.route("/<job_id>", methods=["GET"])
+    def get_job(job_id):
+        # ?wait=<seconds> holds the request open until the job finishes
+        try:
+            wait = min(float(request.args.get("wait", 0)), max_wait)
+        except ValueError:
+            return jsonify({"error": "wait must be a number of seconds"}), 400
+
+        job = job_queue.wait(job_id, timeout=wait) if wait > 0 else job_queue.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+
+        response_data = {"job_id": job["job_id"], "status": job["status"]}
+        if job["result"] is not None:
+            response_data["result"] = job["result"]
+        if job["error"] is not None:
+            response_data["error"] = job["error"]
+        return jsonify(response_data), 200
+
+    return jobs_bp
@@ -0,0 +1,12 @@
+from flask import Blueprint, Response
+from metrics import render_metrics
+
+
+def create_metrics_bp():
+    metrics_bp = Blueprint("metrics_bp", __name__)
+
+    @metrics_bp.route("", methods=["GET"])
+    def get_metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    return metrics_bp
@@ -1,12 +1,13 @@
 from flask import Blueprint, jsonify
-from database.firestore_manager import get_user
+from database.stats_cache import get_user_cached
 
 stats_bp = Blueprint("stats", __name__)
 
 
 @stats_bp.route("/<user_id>", methods=["GET"])
 def get_user_stats(user_id):
-    user_data = get_user(user_id)
+    # Cached, with the user's buffered shots not yet in Firestore added on top
+    user_data = get_user_cached(user_id)
     if user_data:
         stats = {
             "total_shots": user_data.get("total_shots", 0),
@@ -1,10 +1,11 @@
-import os
+import logging
 import random
-import sys
 
-from flask import Blueprint, current_app, jsonify, request, url_for
-from ml.analyze_shot import analyze_user_shot, calculator
-from werkzeug.utils import secure_filename
+from flask import Blueprint, current_app, jsonify, request
+from media_processing.upload_ingest import spool_upload
+from ml.analyze_shot import analyze_user_shot
+
+logger = logging.getLogger(__name__)
 
 
 def create_upload_bp(calculator):
@@ -12,41 +13,48 @@ def create_upload_bp(calculator):
 
     @upload_bp.route("", methods=["POST"])
     def upload_media():
-        print("Received analyze request")
+        logger.info("Received analyze request")
         try:
             player = request.form.get("player", "").strip()
 
-            print(f"Received player: {player}")
+            logger.debug("Received player: %s", player)
 
             if not player:
-                print("Player name is missing or empty")
+                logger.info("Player name is missing or empty")
                 return jsonify({"error": "Player name is required"}), 400
 
             if "file" not in request.files:
-                print("No file part in the request")
+                logger.info("No file part in the request")
                 return jsonify({"error": "No file part"}), 400
 
             file = request.files["file"]
 
             if file.filename == "":
-                print("No selected file")
+                logger.info("No selected file")
                 return jsonify({"error": "No selected file"}), 400
 
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                upload_folder = current_app.config["UPLOAD_FOLDER"]
-
-                # Ensure the upload folder exists
-                os.makedirs(upload_folder, exist_ok=True)
-
-                file_path = os.path.join(upload_folder, filename)
-                file.save(file_path)
-                print(f"File saved to {file_path}")
-
-                print("Starting analysis...")
-                analysis_result = analyze_user_shot(file_path, calculator, player)
-                print("Analysis completed")
-                print(f"Analysis result: {analysis_result}")
+                # Streamed to memory or a unique file, never the shared
+                # folder under the client's filename
+                spool = spool_upload(
+                    file,
+                    current_app.config["UPLOAD_FOLDER"],
+                    current_app.config.get("UPLOAD_MEMORY_BYTES", 0),
+                )
+                logger.debug("Received %d bytes", spool.size)
+
+                logger.debug("Starting analysis...")
+                try:
+                    image = spool.decode_image()
+                    if image is None:
+                        analysis_result = {"error": "Could not decode image"}
+                    else:
+                        analysis_result = analyze_user_shot(
+                            image, calculator, player, content_hash=spool.content_hash
+                        )
+                finally:
+                    spool.close()
+                logger.debug("Analysis result: %s", analysis_result)
 
                 if "error" in analysis_result:
                     return jsonify(analysis_result), 400
@@ -57,13 +65,13 @@ def create_upload_bp(calculator):
                     **analysis_result,
                 }
 
-                print(f"Sending response: {response_data}")
+                logger.debug("Sending response: %s", response_data)
                 return jsonify(response_data), 200
 
-            print("File type not allowed")
+            logger.info("File type not allowed")
             return jsonify({"error": "File type not allowed"}), 400
         except Exception as e:
-            print(f"Unexpected error in analyze_shot: {str(e)}")
+            logger.exception("Unexpected error in analyze_shot")
             return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
     return upload_bp
@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ml.ann_index import IVFIndex
+from ml.pose_index import ProPoseIndex
+
+# Recall and latency of the IVF index against exact search on a synthetic,
+# clustered pose corpus. Prints one JSON object so runs can be compared.
+
+
+def synthetic_corpus(players, poses_per_player, clusters, noise, rng):
+    centers = rng.normal(size=(clusters, 33 * 3))
+    pro_poses = {}
+    for player in range(players):
+        picked = centers[rng.integers(0, clusters, size=poses_per_player)]
+        poses = picked + noise * rng.normal(size=picked.shape)
+        pro_poses[f"player_{player}"] = list(poses.reshape(-1, 33, 3).astype(np.float32))
+    return pro_poses, centers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--poses-per-player", type=int, default=500)
+    parser.add_argument("--clusters", type=int, default=300)
+    parser.add_argument("--noise", type=float, default=0.3)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    pro_poses, centers = synthetic_corpus(
+        args.players, args.poses_per_player, args.clusters, args.noise, rng
+    )
+    index = ProPoseIndex.from_poses(pro_poses)
+    queries = centers[rng.integers(0, args.clusters, size=args.queries)]
+    queries = (queries + args.noise * rng.normal(size=queries.shape)).reshape(-1, 33, 3)
+
+    start = time.perf_counter()
+    ann = IVFIndex.build(index, args.nlist)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact = [index.best_match_per_player(query) for query in queries]
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+    best = [max(matches.values(), key=lambda m: m.similarity) for matches in exact]
+
+    runs = []
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        approximate = [ann.best_match_per_player(query, index, nprobe) for query in queries]
+        ann_ms = (time.perf_counter() - start) / len(queries) * 1000
+        hits = sum(
+            match.player in found and found[match.player].row == match.row
+            for match, found in zip(best, approximate)
+        )
+        runs.append({"nprobe": nprobe, "recall_at_1": hits / len(queries), "query_ms": ann_ms})
+
+    print(
+        json.dumps(
+            {
+                "poses": len(index),
+                "nlist": len(ann.centroids),
+                "build_seconds": build_seconds,
+                "exact_query_ms": exact_ms,
+                "ann": runs,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
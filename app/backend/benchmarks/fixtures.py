@@ -0,0 +1,29 @@
+import glob
+import os
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_IMAGE = os.path.join(BACKEND_DIR, "ml", "test.png")
+PRO_SCREENSHOTS = sorted(glob.glob(os.path.join(BACKEND_DIR, "ml", "pro_players", "*", "*.png")))
+
+
+def synthetic_landmarks(base_pose, count, noise=0.02, seed=0):
+    # (count, 33, 3) poses jittered around a real pose
+    rng = np.random.default_rng(seed)
+    base_pose = np.asarray(base_pose, dtype=np.float32).reshape(1, 33, 3)
+    return base_pose + noise * rng.standard_normal((count, 33, 3)).astype(np.float32)
+
+
+def synthetic_shot_video(path, frames=150, fps=30, image_path=TEST_IMAGE):
+    # The sample image moved up and back down, a stand-in for a jump shot
+    image = cv2.imread(image_path)
+    height, width = image.shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for i in range(frames):
+        dy = int(0.3 * height * np.sin(i / frames * 2 * np.pi))
+        shift = np.float32([[1, 0, 0], [0, 1, dy]])
+        writer.write(cv2.warpAffine(image, shift, (width, height)))
+    writer.release()
+    return path
@@ -0,0 +1,69 @@
+import gc
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def run_case(func, iterations=20, warmup=2, items=1):
+    # Calls func() repeatedly and summarizes per-call latency. items is how
+    # many units of work one call handles (frames, poses, ...), so
+    # throughput is comparable between batch and single-item cases.
+    for _ in range(warmup):
+        func()
+    gc.collect()
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    total = time.perf_counter() - started
+    timings_ms = np.array(timings) * 1000
+    return {
+        "iterations": iterations,
+        "items_per_call": items,
+        "throughput_per_s": items * iterations / total if total else None,
+        "mean_ms": float(timings_ms.mean()),
+        "p50_ms": float(np.percentile(timings_ms, 50)),
+        "p95_ms": float(np.percentile(timings_ms, 95)),
+        "p99_ms": float(np.percentile(timings_ms, 99)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def environment():
+    import cv2
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(current, baseline, threshold=0.1):
+    # Cases whose p50 got slower than baseline by more than threshold
+    regressions = []
+    for name, stats in current.items():
+        before = baseline.get(name)
+        if not before or not before.get("p50_ms"):
+            continue
+        change = stats["p50_ms"] / before["p50_ms"] - 1
+        stats["p50_change"] = change
+        if change > threshold:
+            regressions.append((name, change))
+    return regressions
@@ -0,0 +1,239 @@
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import cv2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fixtures import (
+    PRO_SCREENSHOTS,
+    TEST_IMAGE,
+    synthetic_landmarks,
+    synthetic_shot_video,
+)
+from benchmarks.harness import compare, environment, run_case
+from config import Config
+
+# Benchmarks for the analysis hot paths, offline and CPU-only, on the bundled
+# sample images, synthetic landmarks and a synthetic clip. Results are
+# printed (or written with --output) as JSON; --baseline compares against an
+# earlier run and exits non-zero when a case's p50 regressed.
+#
+#   python benchmarks/run_benchmarks.py --output before.json
+#   python benchmarks/run_benchmarks.py --baseline before.json
+#
+# The landmark cache is disabled so every run measures real inference. Each
+# case runs in its own process, so its peak_rss_mb (ru_maxrss, a process-wide
+# high-water mark) covers the shared fixtures and that case only.
+
+CASES = {}
+
+
+def case(name):
+    def register(func):
+        CASES[name] = func
+        return func
+
+    return register
+
+
+@case("pose_extraction_image")
+def bench_pose_extraction_image(context):
+    from media_processing.image_processor import extract_pose_landmarks
+
+    image = cv2.imread(TEST_IMAGE)
+    return lambda: extract_pose_landmarks(image), 1
+
+
+@case("pose_extraction_pro_screenshots")
+def bench_pose_extraction_pro_screenshots(context):
+    from media_processing.image_processor import extract_pose_landmarks
+
+    images = [cv2.imread(path) for path in PRO_SCREENSHOTS]
+
+    def run():
+        for image in images:
+            extract_pose_landmarks(image)
+
+    return run, len(images)
+
+
+@case("calculate_similarity_player")
+def bench_calculate_similarity_player(context):
+    calculator = context["calculator"]
+    user = context["landmarks"][0]
+    return lambda: calculator.calculate_similarity(user, context["player"]), 1
+
+
+@case("calculate_similarity_all_players")
+def bench_calculate_similarity_all_players(context):
+    calculator = context["calculator"]
+    user = context["landmarks"][0]
+    return lambda: calculator.calculate_similarity(user), 1
+
+
+@case("get_angle_differences")
+def bench_get_angle_differences(context):
+    calculator = context["calculator"]
+    user = context["landmarks"][0]
+    return lambda: calculator.get_angle_differences(user, context["player"]), 1
+
+
+@case("score_batch")
+def bench_score_batch(context):
+    from ml.analyze_shot import analyze_user_shots_batch
+
+    batch = context["landmarks"]
+    return (
+        lambda: analyze_user_shots_batch(batch, context["calculator"], context["player"]),
+        len(batch),
+    )
+
+
+@case("process_video")
+def bench_process_video(context):
+    from ml.video_analysis import process_video
+
+    video = context["video"]
+    stride = 5
+    frames = int(cv2.VideoCapture(video).get(cv2.CAP_PROP_FRAME_COUNT))
+    return (
+        lambda: process_video(video, context["calculator"], context["player"], stride=stride),
+        -(-frames // stride),
+    )
+
+
+@case("upload_route_image")
+def bench_upload_route_image(context):
+    client = context["client"]
+    with open(TEST_IMAGE, "rb") as f:
+        image = f.read()
+
+    def run():
+        response = client.post(
+            "/upload",
+            data={"player": context["player"], "file": (io.BytesIO(image), "test.png")},
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 200, response.get_json()
+
+    return run, 1
+
+
+@case("upload_route_video")
+def bench_upload_route_video(context):
+    client = context["client"]
+    with open(context["video"], "rb") as f:
+        video = f.read()
+
+    def run():
+        response = client.post(
+            "/upload",
+            data={
+                "player": context["player"],
+                "is_video": "true",
+                "async": "false",
+                "stride": "5",
+                "file": (io.BytesIO(video), "shot.mp4"),
+            },
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 200, response.get_json()
+
+    return run, 1
+
+
+def build_context(workdir, batch_size):
+    from main import create_app
+    from ml.registry import get_calculator
+
+    calculator = get_calculator()
+    player = calculator.index.players[0]
+    app = create_app()
+    app.config["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+    return {
+        "calculator": calculator,
+        "player": player,
+        "landmarks": synthetic_landmarks(calculator.index.poses[0], batch_size),
+        "video": synthetic_shot_video(os.path.join(workdir, "shot.mp4")),
+        "client": app.test_client(),
+    }
+
+
+def run_isolated(name, args):
+    # Runs one case in a fresh interpreter and returns its stats
+    with tempfile.TemporaryDirectory() as workdir:
+        output = os.path.join(workdir, "result.json")
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--only",
+            name,
+            "--iterations",
+            str(args.iterations),
+            "--warmup",
+            str(args.warmup),
+            "--batch-size",
+            str(args.batch_size),
+            "--output",
+            output,
+        ]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(output) as f:
+            return json.load(f)["benchmarks"][name]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", nargs="+", choices=sorted(CASES), help="cases to run")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed p50 slowdown")
+    args = parser.parse_args()
+
+    Config.LANDMARK_CACHE_ENABLED = False
+    Config.PRELOAD_CALCULATOR = False
+    # Keep application prints out of the JSON on stdout
+    real_stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    results = {}
+    names = args.only or list(CASES)
+    if len(names) == 1:
+        with tempfile.TemporaryDirectory() as workdir:
+            context = build_context(workdir, args.batch_size)
+            print(f"Running {names[0]}...")
+            func, items = CASES[names[0]](context)
+            results[names[0]] = run_case(func, args.iterations, args.warmup, items)
+    else:
+        for name in names:
+            print(f"Running {name}...")
+            results[name] = run_isolated(name, args)
+
+    report = {"environment": environment(), "benchmarks": results}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["benchmarks"], args.threshold)
+        report["regressions"] = [{"case": name, "p50_change": change} for name, change in regressions]
+
+    sys.stdout = real_stdout
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
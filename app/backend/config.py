@@ -4,7 +4,139 @@ import os
 class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
     SECRET_KEY = os.environ.get("SECRET_KEY") or "your-secret-key"
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max upload size
+    # Largest accepted request body; uploads up to UPLOAD_MEMORY_BYTES are
+    # kept in memory, larger ones are streamed to a unique file
+    MAX_CONTENT_LENGTH = int(os.environ.get("MAX_CONTENT_LENGTH", 100 * 1024 * 1024))
+    UPLOAD_MEMORY_BYTES = int(os.environ.get("UPLOAD_MEMORY_BYTES", 8 * 1024 * 1024))
+    # Number of long-lived MediaPipe Pose estimators kept per process
+    POSE_POOL_SIZE = int(os.environ.get("POSE_POOL_SIZE", 2))
+    # Analyses (decode, pose inference, scoring) run at once per process, on
+    # their own thread pool; 0 runs them on the request thread
+    INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", POSE_POOL_SIZE))
+    # Admission control for synchronous analyses, per process. Cost is
+    # counted in frames posed at POSE_INFERENCE_MAX_SIDE (an image is 1, a
+    # video its sampled frames scaled by resolution). Work beyond
+    # ADMISSION_BUDGET waits up to ADMISSION_MAX_WAIT seconds, at most
+    # ADMISSION_MAX_QUEUE requests per kind, and is otherwise answered with
+    # 503 and Retry-After. Videos may only use the budget left after
+    # ADMISSION_IMAGE_RESERVE (a fraction) is kept for images, and waiting
+    # images go first. A budget of 0 turns admission control off.
+    ADMISSION_BUDGET = float(os.environ.get("ADMISSION_BUDGET", 120))
+    ADMISSION_IMAGE_RESERVE = float(os.environ.get("ADMISSION_IMAGE_RESERVE", 0.2))
+    ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 16))
+    ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 2))
+    ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 5))
+    # Track the pose across consecutive video frames instead of detecting it
+    # on every frame; frames more than POSE_TRACKING_MAX_GAP apart (as with
+    # the default VIDEO_FRAME_STRIDE) are detected afresh, and sampled frames
+    # whose key joints have a mean visibility under MIN_KEY_JOINT_VISIBILITY
+    # are dropped
+    VIDEO_POSE_TRACKING = os.environ.get("VIDEO_POSE_TRACKING", "true").lower() == "true"
+    POSE_TRACKING_CONFIDENCE = float(os.environ.get("POSE_TRACKING_CONFIDENCE", 0.5))
+    POSE_TRACKING_MAX_GAP = int(os.environ.get("POSE_TRACKING_MAX_GAP", 5))
+    MIN_KEY_JOINT_VISIBILITY = float(os.environ.get("MIN_KEY_JOINT_VISIBILITY", 0.0))
+    # Frames are shrunk so their longer side is at most this many pixels
+    # before pose inference (0 keeps full resolution). Video frames that are
+    # detected rather than tracked are also cropped to the player region of
+    # the last pose found, grown by POSE_ROI_MARGIN times the pose size per
+    # side.
+    POSE_INFERENCE_MAX_SIDE = int(os.environ.get("POSE_INFERENCE_MAX_SIDE", 960))
+    POSE_ROI_CROP = os.environ.get("POSE_ROI_CROP", "true").lower() == "true"
+    POSE_ROI_MARGIN = float(os.environ.get("POSE_ROI_MARGIN", 0.5))
+    # Per-frame detail in video responses: "full" (frame_results), "summary"
+    # or "columns"; clients can override it with the detail form field
+    VIDEO_RESPONSE_DETAIL = os.environ.get("VIDEO_RESPONSE_DETAIL", "full")
+    # Client-side landmark uploads (POST /upload/landmarks): most frames per
+    # payload, and the smallest torso (fraction of the frame) a frame needs
+    # to be scored
+    LANDMARK_UPLOAD_MAX_FRAMES = int(os.environ.get("LANDMARK_UPLOAD_MAX_FRAMES", 900))
+    LANDMARK_MIN_TORSO = float(os.environ.get("LANDMARK_MIN_TORSO", 0.02))
+    # Default video sampling: analyze every Nth decoded frame
+    VIDEO_FRAME_STRIDE = int(os.environ.get("VIDEO_FRAME_STRIDE", 30))
+    # Load the pro pose library when the app is created instead of lazily on
+    # the first request
+    PRELOAD_CALCULATOR = os.environ.get("PRELOAD_CALCULATOR", "true").lower() == "true"
+    # Memory-mapped pro pose library (see ml/pose_store.py)
+    PRO_POSE_STORE_DIR = os.environ.get("PRO_POSE_STORE_DIR") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "ml", "pro_pose_store"
+    )
+    # Seconds between checks for a new store generation; a running worker
+    # loads it in the background and swaps it in (0 disables the check)
+    PRO_RELOAD_INTERVAL = float(os.environ.get("PRO_RELOAD_INTERVAL", 10))
+    # New or changed files under ml/pro_players are ingested once the
+    # directory has been unchanged for PRO_WATCH_INTERVAL seconds (0 turns
+    # the watcher off); reference clips are sampled at PRO_CLIP_FPS
+    PRO_WATCH_INTERVAL = float(os.environ.get("PRO_WATCH_INTERVAL", 30))
+    PRO_CLIP_FPS = float(os.environ.get("PRO_CLIP_FPS", 10))
+    # Bearer token for the /admin endpoints, which are disabled without one
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+    # Shot segmentation: a low-resolution pass at PHASE_SCAN_FPS finds the
+    # gather, set point and release, and only that window (plus padding) is
+    # analyzed, every PHASE_DENSE_STRIDE-th frame
+    VIDEO_SEGMENT_SHOT = os.environ.get("VIDEO_SEGMENT_SHOT", "false").lower() == "true"
+    PHASE_SCAN_FPS = float(os.environ.get("PHASE_SCAN_FPS", 10))
+    PHASE_SCAN_WIDTH = int(os.environ.get("PHASE_SCAN_WIDTH", 320))
+    PHASE_SCAN_MODEL_COMPLEXITY = int(os.environ.get("PHASE_SCAN_MODEL_COMPLEXITY", 1))
+    PHASE_GATHER_SECONDS = float(os.environ.get("PHASE_GATHER_SECONDS", 1.5))
+    PHASE_PADDING_SECONDS = float(os.environ.get("PHASE_PADDING_SECONDS", 0.2))
+    PHASE_DENSE_STRIDE = int(os.environ.get("PHASE_DENSE_STRIDE", 2))
+    # Approximate nearest-neighbour (IVF) search for "which pro" queries over
+    # the whole library, used once it holds ANN_MIN_POSES poses
+    ANN_ENABLED = os.environ.get("ANN_ENABLED", "true").lower() == "true"
+    ANN_MIN_POSES = int(os.environ.get("ANN_MIN_POSES", 20000))
+    ANN_NLIST = int(os.environ.get("ANN_NLIST", 0))  # 0: 4 * sqrt(poses)
+    ANN_NPROBE = int(os.environ.get("ANN_NPROBE", 8))
+    PRO_ANN_INDEX_FILE = os.environ.get("PRO_ANN_INDEX_FILE") or os.path.join(
+        PRO_POSE_STORE_DIR, "ann.npz"
+    )
+    # Motion comparison against pro clips with DTW (see ml/sequence_matching.py)
+    VIDEO_COMPARE_MOTION = os.environ.get("VIDEO_COMPARE_MOTION", "false").lower() == "true"
+    PRO_SEQUENCE_FILE = os.environ.get("PRO_SEQUENCE_FILE") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "ml", "pro_sequences.npz"
+    )
+    DTW_BAND = float(os.environ.get("DTW_BAND", 0.1))
+    DTW_RESAMPLE_LENGTH = int(os.environ.get("DTW_RESAMPLE_LENGTH", 64))
+    DTW_TOP_K = int(os.environ.get("DTW_TOP_K", 5))
+    # Split a single video across this many processes (1 disables it)
+    VIDEO_PARALLEL_WORKERS = int(os.environ.get("VIDEO_PARALLEL_WORKERS", 1))
+    VIDEO_CHUNK_FRAMES = int(os.environ.get("VIDEO_CHUNK_FRAMES", 240))
+    # Content-addressed cache of extracted landmarks for repeated uploads
+    LANDMARK_CACHE_ENABLED = os.environ.get("LANDMARK_CACHE_ENABLED", "true").lower() == "true"
+    LANDMARK_CACHE_DIR = os.environ.get("LANDMARK_CACHE_DIR") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "cache", "landmarks"
+    )
+    LANDMARK_CACHE_MAX_BYTES = int(os.environ.get("LANDMARK_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+    LANDMARK_CACHE_MEMORY_BYTES = int(os.environ.get("LANDMARK_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+    # Background video analysis jobs
+    ASYNC_VIDEO_UPLOADS = os.environ.get("ASYNC_VIDEO_UPLOADS", "false").lower() == "true"
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+    # "sqlite" shares jobs between the server processes on a box; "memory"
+    # only works with a single process (GUNICORN_WORKERS=1)
+    JOB_BACKEND = os.environ.get("JOB_BACKEND", "sqlite")
+    JOB_DB_PATH = os.environ.get("JOB_DB_PATH") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "cache", "jobs.sqlite3"
+    )
+    JOB_START_METHOD = os.environ.get("JOB_START_METHOD", "spawn")
+    JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", 30))
+    # Seconds a finished job and its result are kept for polling
+    JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", 3600))
+    # Seconds after which a job still queued is failed as interrupted; jobs
+    # whose server process has exited are failed right away
+    JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", 1800))
+    # Debug logging, including full analysis results (large for videos)
+    VERBOSE_LOGGING = os.environ.get("VERBOSE_LOGGING", "false").lower() == "true"
     FIREBASE_CREDENTIALS = (
         "/Users/mark/Downloads/aivison-225c2-firebase-adminsdk-xtwka-c84f90ec7c.json"
     )
+    # "firestore", or "memory" for the in-process fake in database/memory_store.py
+    FIRESTORE_BACKEND = os.environ.get("FIRESTORE_BACKEND", "firestore")
+    # Shot writes are buffered and committed in batches once this many writes
+    # are pending or FIRESTORE_FLUSH_SECONDS have passed; failed commits are
+    # spilled to FIRESTORE_SPILL_FILE and retried on the next flush
+    FIRESTORE_BATCH_SIZE = int(os.environ.get("FIRESTORE_BATCH_SIZE", 50))
+    FIRESTORE_FLUSH_SECONDS = float(os.environ.get("FIRESTORE_FLUSH_SECONDS", 2.0))
+    FIRESTORE_SPILL_FILE = os.environ.get("FIRESTORE_SPILL_FILE") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "cache", "firestore_spill.jsonl"
+    )
+    # Seconds user stats are served from memory before Firestore is read again
+    USER_STATS_TTL = float(os.environ.get("USER_STATS_TTL", 30))
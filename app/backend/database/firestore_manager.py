@@ -67,3 +67,34 @@ def add_shot_analysis(user_id, analysis_data, image_url):
     analysis_data["image_url"] = image_url
     shot_ref.set(analysis_data)
     return shot_ref.id
+
+
+# Firestore rejects batches of more than 500 writes
+MAX_BATCH_WRITES = 500
+
+
+def commit_writes(stat_increments, shots):
+    # Applies buffered writes (see write_buffer.py) in as few batched commits
+    # as possible. Batches commit one after another, so a failure can leave
+    # earlier ones applied; the write buffer hands over at most one batch. stat_increments: {user_id: {field: amount}}; shots: dicts
+    # with user_id, shot_id and data. Shots get their server timestamp here.
+    database = get_db()
+    writes = []
+    for user_id, increments in stat_increments.items():
+        user_ref = database.collection("users").document(generate_document_id(user_id))
+        update = {field: firestore.Increment(amount) for field, amount in increments.items()}
+        writes.append(("update", user_ref, update))
+    for shot in shots:
+        shot_ref = (
+            database.collection("users")
+            .document(generate_document_id(shot["user_id"]))
+            .collection("shots")
+            .document(shot["shot_id"])
+        )
+        writes.append(("set", shot_ref, {**shot["data"], "timestamp": firestore.SERVER_TIMESTAMP}))
+
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = database.batch()
+        for method, ref, data in writes[start : start + MAX_BATCH_WRITES]:
+            getattr(batch, method)(ref, data)
+        batch.commit()
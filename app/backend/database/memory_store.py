@@ -0,0 +1,36 @@
+import copy
+import threading
+
+from database.stats_cache import apply_increments
+
+# In-memory stand-in for firestore_manager, for local runs without Firebase
+# credentials and for exercising the write buffer. Implements the subset the
+# buffer and stats cache use: get_user, add_user and commit_writes.
+
+
+class InMemoryFirestore:
+    def __init__(self):
+        self.users = {}
+        self.shots = {}
+        self.commits = 0
+        self._lock = threading.Lock()
+
+    def add_user(self, user_data):
+        with self._lock:
+            self.users[user_data["uid"]] = copy.deepcopy(user_data)
+
+    def get_user(self, user_id):
+        with self._lock:
+            user = self.users.get(user_id)
+            return copy.deepcopy(user) if user is not None else None
+
+    def commit_writes(self, stat_increments, shots):
+        with self._lock:
+            for user_id, increments in stat_increments.items():
+                user = self.users.get(user_id, {"uid": user_id})
+                self.users[user_id] = apply_increments(user, increments)
+            for shot in shots:
+                self.shots.setdefault(shot["user_id"], {})[shot["shot_id"]] = copy.deepcopy(
+                    shot["data"]
+                )
+            self.commits += 1
@@ -0,0 +1,108 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+from database.write_buffer import get_store, get_write_buffer
+
+# Read-through cache for user stats. Entries expire after ttl seconds and are
+# dropped as soon as the write buffer commits writes for that user; until
+# then, increments still sitting in the buffer are added on top of the cached
+# document so a user sees their own shots right away. Reads that overlap a
+# flush are retried and never cached, so neither a stale document nor a
+# doubly counted increment can stick for the whole ttl.
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, see set()
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, generation=None):
+        # With the generation read before the value was fetched, the value is
+        # dropped if an invalidation ran meanwhile: it may predate that write
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+def apply_increments(user, increments):
+    user = copy.deepcopy(user)
+    for field, amount in increments.items():
+        target = user
+        *parents, leaf = field.split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = target.get(leaf, 0) + amount
+    return user
+
+
+_stats_cache = None
+_stats_cache_lock = threading.Lock()
+
+
+def get_stats_cache():
+    global _stats_cache
+    if _stats_cache is None:
+        with _stats_cache_lock:
+            if _stats_cache is None:
+                cache = TTLCache(Config.USER_STATS_TTL)
+                get_write_buffer().listeners.append(cache.invalidate)
+                _stats_cache = cache
+    return _stats_cache
+
+
+def get_user_cached(user_id):
+    cache = get_stats_cache()
+    buffer = get_write_buffer()
+    user = cache.get(user_id)
+    if user is not _MISSING:
+        pending = buffer.pending_increments(user_id)
+        return apply_increments(user, pending) if pending else user
+
+    for _ in range(3):
+        generation = cache.generation
+        sequence = buffer.flush_sequence
+        user = get_store().get_user(user_id)
+        pending = buffer.pending_increments(user_id)
+        # An odd sequence is a flush in progress. If one overlapped the read,
+        # the document may already contain the in-flight increments that
+        # pending still reports, so wait for it and read again.
+        if sequence % 2 == 0 and buffer.flush_sequence == sequence:
+            if user is not None:
+                # Misses are not cached: add_user never invalidates
+                cache.set(user_id, user, generation)
+            break
+        buffer.wait_for_flush()
+    if not user:
+        return user
+    return apply_increments(user, pending) if pending else user
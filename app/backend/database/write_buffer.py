@@ -0,0 +1,303 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Write-behind buffer for per-shot Firestore writes. Recording a shot used to
+# cost two blocking round trips (stats update, then the shot document); now
+# it only touches memory. Stat increments for the same user are merged and
+# everything pending goes out in one batched commit once max_writes are
+# queued or flush_interval seconds have passed. A failed commit is appended
+# to a local JSON lines spill file and replayed before the next flush, so a
+# Firestore outage delays writes instead of losing them. The spill file is
+# shared by the worker processes on the host and guarded by a file lock.
+
+
+# Firestore's limit on writes in one batch commit
+MAX_BATCH_WRITES = 500
+
+
+def new_shot_id():
+    # Same shape as Firestore's auto IDs, assigned up front so the client gets
+    # its shot_id before the document is written
+    return uuid.uuid4().hex[:20]
+
+
+def split_writes(increments, shots, size=MAX_BATCH_WRITES):
+    # -> [(increments, shots)] pieces of at most size writes. Each piece is
+    # one batch commit, which lands as a whole or not at all, so after a
+    # failure only the pieces not committed yet are spilled and Increments
+    # are never applied twice.
+    users = list(increments)
+    pieces = []
+    for start in range(0, len(users) + len(shots), size):
+        stop = start + size
+        pieces.append(
+            (
+                {user_id: increments[user_id] for user_id in users[start:stop]},
+                shots[max(0, start - len(users)) : max(0, stop - len(users))],
+            )
+        )
+    return pieces
+
+
+class FirestoreWriteBuffer:
+    def __init__(self, store, max_writes=None, flush_interval=None, spill_path=None):
+        # store: firestore_manager, or anything with commit_writes()
+        self.store = store
+        self.max_writes = max_writes or Config.FIRESTORE_BATCH_SIZE
+        self.flush_interval = (
+            Config.FIRESTORE_FLUSH_SECONDS if flush_interval is None else flush_interval
+        )
+        self.spill_path = spill_path or Config.FIRESTORE_SPILL_FILE
+        self.listeners = []
+        self._increments = {}
+        self._shots = []
+        self._in_flight = {}
+        # Incremented when a flush starts committing and again when it is
+        # done, so it is odd while writes are in flight
+        self.flush_sequence = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if self.flush_interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Pending writes stay queued for the next round
+                logger.exception("Flushing buffered Firestore writes failed")
+
+    def _pending_writes(self):
+        return len(self._increments) + len(self._shots)
+
+    def increment_stats(self, user_id, increments):
+        with self._lock:
+            pending = self._increments.setdefault(user_id, {})
+            for field, amount in increments.items():
+                pending[field] = pending.get(field, 0) + amount
+            full = self._pending_writes() >= self.max_writes
+        if full:
+            self._wake_or_flush()
+
+    def add_shot(self, user_id, data, shot_id=None):
+        shot_id = shot_id or new_shot_id()
+        with self._lock:
+            self._shots.append({"user_id": user_id, "shot_id": shot_id, "data": data})
+            full = self._pending_writes() >= self.max_writes
+        if full:
+            self._wake_or_flush()
+        return shot_id
+
+    def _wake_or_flush(self):
+        if self._thread is not None:
+            self._wake.set()
+        else:
+            self.flush()
+
+    def pending_increments(self, user_id):
+        # Increments not yet committed, queued or in flight, so readers can
+        # overlay them on what Firestore returns
+        with self._lock:
+            merged = dict(self._in_flight.get(user_id, {}))
+            for field, amount in self._increments.get(user_id, {}).items():
+                merged[field] = merged.get(field, 0) + amount
+        return merged
+
+    def flush(self):
+        with self._flush_lock:
+            self._replay_spill()
+            with self._lock:
+                if not self._increments and not self._shots:
+                    return
+                increments, self._increments = self._increments, {}
+                shots, self._shots = self._shots, []
+                self._in_flight = increments
+                self.flush_sequence += 1
+            try:
+                pieces = split_writes(increments, shots)
+                for i, (piece_increments, piece_shots) in enumerate(pieces):
+                    try:
+                        self.store.commit_writes(piece_increments, piece_shots)
+                    except Exception:
+                        logger.exception(
+                            "Firestore commit failed, spilling %d piece(s) to %s",
+                            len(pieces) - i,
+                            self.spill_path,
+                        )
+                        self._spill(pieces[i:])
+                        break
+                    self._notify(piece_increments, piece_shots)
+            finally:
+                with self._lock:
+                    self._in_flight = {}
+                    self.flush_sequence += 1
+
+    def wait_for_flush(self):
+        # Returns once no flush is running
+        with self._flush_lock:
+            pass
+
+    @contextmanager
+    def _spill_lock(self, blocking=True):
+        # Every worker process on the host shares the spill file, so appends
+        # and replays take turns on a lock next to it. Yields False when
+        # blocking=False and another process holds it.
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        with open(f"{self.spill_path}.lock", "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _spill(self, pieces):
+        with self._spill_lock():
+            with open(self.spill_path, "a") as f:
+                self._write_spill(
+                    f, [{"increments": increments, "shots": shots} for increments, shots in pieces]
+                )
+
+    def _write_spill(self, f, entries):
+        for entry in entries:
+            f.write(
+                json.dumps(
+                    {
+                        "increments": entry["increments"],
+                        "shots": entry["shots"],
+                        "at": entry.get("at", time.time()),
+                    }
+                )
+            )
+            f.write("\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _read_spill(self):
+        entries = []
+        with open(self.spill_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    # Both parts must be there
+                    entry["increments"], entry["shots"]
+                except (ValueError, TypeError, KeyError):
+                    # A torn write, e.g. from a crash mid-append; kept aside
+                    # for inspection instead of blocking every later replay
+                    logger.error(
+                        "Skipping corrupt spill entry, moved to %s.corrupt", self.spill_path
+                    )
+                    with open(f"{self.spill_path}.corrupt", "a") as corrupt:
+                        corrupt.write(line if line.endswith("\n") else line + "\n")
+                    continue
+                entries.append(entry)
+        return entries
+
+    def _replay_spill(self):
+        if not os.path.exists(self.spill_path):
+            return
+        with self._spill_lock(blocking=False) as locked:
+            # Another worker is replaying it, or already did
+            if not locked or not os.path.exists(self.spill_path):
+                return
+            entries = self._read_spill()
+            remaining = []
+            for i, entry in enumerate(entries):
+                try:
+                    self.store.commit_writes(entry["increments"], entry["shots"])
+                except Exception:
+                    logger.exception("Replaying spilled Firestore writes failed")
+                    # Keep this entry and everything after it for the next flush
+                    remaining = entries[i:]
+                    break
+                self._notify(entry["increments"], entry["shots"])
+            # Nothing is appended while the lock is held, so the file can be
+            # replaced by what is left
+            if remaining:
+                tmp_path = f"{self.spill_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    self._write_spill(f, remaining)
+                os.replace(tmp_path, self.spill_path)
+            else:
+                os.remove(self.spill_path)
+
+    def _notify(self, increments, shots):
+        users = set(increments) | {shot["user_id"] for shot in shots}
+        for listener in self.listeners:
+            listener(users)
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+
+def record_shot(user_id, target_player, shot_data, image_url=None):
+    # Buffered replacement for update_user_stats + add_shot_analysis
+    buffer = get_write_buffer()
+    buffer.increment_stats(
+        user_id,
+        {"total_shots": 1, "streak": 1, f"player_counts.{target_player}": 1},
+    )
+    return buffer.add_shot(user_id, {**shot_data, "image_url": image_url})
+
+
+_write_buffer = None
+_write_buffer_lock = threading.Lock()
+
+
+def get_write_buffer():
+    global _write_buffer
+    if _write_buffer is None:
+        with _write_buffer_lock:
+            if _write_buffer is None:
+                _write_buffer = FirestoreWriteBuffer(get_store()).start()
+    return _write_buffer
+
+
+_store = None
+
+
+def get_store():
+    # firestore_manager, or the in-memory fake with FIRESTORE_BACKEND=memory
+    global _store
+    if _store is None:
+        if Config.FIRESTORE_BACKEND == "memory":
+            from database.memory_store import InMemoryFirestore
+
+            _store = InMemoryFirestore()
+        else:
+            from database import firestore_manager
+
+            _store = firestore_manager
+    return _store
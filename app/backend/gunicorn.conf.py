@@ -0,0 +1,31 @@
+import os
+
+# gunicorn -c gunicorn.conf.py 'main:create_app()'
+wsgi_app = "main:create_app()"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+
+if workers > 1 and os.environ.get("JOB_BACKEND", "sqlite") == "memory":
+    # Jobs would only be visible to the worker that accepted the upload, so a
+    # poll landing on another worker would get a 404
+    raise RuntimeError("JOB_BACKEND=memory needs GUNICORN_WORKERS=1; use sqlite")
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+# Connections served per worker on threads (gthread). Slow uploads only hold
+# a thread; analyses are capped separately by INFERENCE_THREADS.
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+worker_class = "gthread" if threads > 1 else "sync"
+
+# Import the app, and with it the memory-mapped pro pose library, once in the
+# master; workers are forked with it already loaded
+preload_app = True
+
+
+def post_fork(server, worker):
+    # MediaPipe graphs run native threads that do not survive a fork, so each
+    # worker builds its own pose estimators after forking
+    from media_processing.image_processor import warm_up_pose_pool
+    from ml.pro_library import start_library_watcher
+
+    warm_up_pose_pool()
+    # Threads do not survive the fork either
+    start_library_watcher()
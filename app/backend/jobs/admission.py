@@ -0,0 +1,154 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from config import Config
+from media_processing.video_frames import read_video_info, sampling_stride
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_REJECTED
+from werkzeug.exceptions import ServiceUnavailable
+
+# Admission control in front of the synchronous analyses. Each request is
+# charged an estimated cost before any decoding; while the admitted cost is
+# over budget new requests wait briefly and are then turned away, so a burst
+# of uploads gets fast 503s instead of every request slowing down together.
+# Images have a priority lane: part of the budget is kept for them and
+# waiting images are admitted before waiting videos.
+
+KINDS = ("image", "video")
+# One frame at 960x540 is the cost unit when inference frames are not shrunk
+REFERENCE_PIXELS = 960 * 540
+
+
+class Overloaded(ServiceUnavailable):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Server is busy ({reason}), retry later", retry_after=retry_after)
+        self.reason = reason
+
+
+def frame_cost(width, height):
+    # Relative cost of posing one frame after the POSE_INFERENCE_MAX_SIDE
+    # downscale; pose inference dominates and scales with pixel count
+    max_side = Config.POSE_INFERENCE_MAX_SIDE
+    if max_side:
+        scale = min(1.0, max_side / float(max(width, height, 1)))
+        reference = max_side * max_side * 9 / 16
+    else:
+        scale = 1.0
+        reference = REFERENCE_PIXELS
+    return width * height * scale * scale / reference
+
+
+def estimate_video_cost(video_path, stride=None, target_fps=None, max_frames=None, **_):
+    # From the container header only: frame count, fps and resolution
+    info = read_video_info(video_path)
+    step = sampling_stride(info["fps"], info["frame_count"], stride, target_fps, max_frames)
+    frames = math.ceil(max(info["frame_count"], 1) / step)
+    if max_frames:
+        frames = min(frames, int(max_frames))
+    return frames * frame_cost(info["width"], info["height"])
+
+
+class AdmissionController:
+    def __init__(
+        self, budget, image_reserve=0.0, max_queue=16, max_wait=2.0, retry_after=5
+    ):
+        self.budget = budget
+        self.image_reserve = image_reserve
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._in_flight = {kind: 0.0 for kind in KINDS}
+        self._waiting = {kind: deque() for kind in KINDS}
+
+    def _limit(self, kind):
+        if kind == "image":
+            return self.budget
+        return self.budget * (1 - self.image_reserve)
+
+    def _fits(self, kind, cost):
+        in_flight = sum(self._in_flight.values())
+        # A request larger than the whole budget still runs, on its own
+        return in_flight == 0 or in_flight + cost <= self._limit(kind)
+
+    def _is_next(self, kind, ticket):
+        if self._waiting[kind][0] is not ticket:
+            return False
+        return kind == "image" or not self._waiting["image"]
+
+    def _publish(self):
+        for kind in KINDS:
+            ADMISSION_IN_FLIGHT.set(self._in_flight[kind], kind=kind)
+            ADMISSION_QUEUED.set(len(self._waiting[kind]), kind=kind)
+
+    def _reject(self, kind, reason):
+        ADMISSION_REJECTED.inc(kind=kind, reason=reason)
+        raise Overloaded(reason, self.retry_after)
+
+    def _acquire(self, kind, cost):
+        with self._cond:
+            waiting = self._waiting[kind]
+            if not waiting and (kind == "image" or not self._waiting["image"]):
+                if self._fits(kind, cost):
+                    self._in_flight[kind] += cost
+                    self._publish()
+                    return
+            if len(waiting) >= self.max_queue:
+                self._reject(kind, "queue_full")
+
+            ticket = object()
+            waiting.append(ticket)
+            self._publish()
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while not (self._is_next(kind, ticket) and self._fits(kind, cost)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject(kind, "timeout")
+                    self._cond.wait(remaining)
+                self._in_flight[kind] += cost
+            finally:
+                waiting.remove(ticket)
+                self._publish()
+                # The next request in line may fit now
+                self._cond.notify_all()
+
+    def _release(self, kind, cost):
+        with self._cond:
+            self._in_flight[kind] = max(0.0, self._in_flight[kind] - cost)
+            self._publish()
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, kind, cost=1.0):
+        # Raises Overloaded when the request cannot be admitted in time
+        if self.budget <= 0:
+            yield
+            return
+        cost = min(float(cost), self.budget)
+        self._acquire(kind, cost)
+        try:
+            yield
+        finally:
+            self._release(kind, cost)
+
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+def get_admission():
+    global _admission
+    if _admission is None:
+        with _admission_lock:
+            if _admission is None:
+                _admission = AdmissionController(
+                    Config.ADMISSION_BUDGET,
+                    Config.ADMISSION_IMAGE_RESERVE,
+                    Config.ADMISSION_MAX_QUEUE,
+                    Config.ADMISSION_MAX_WAIT,
+                    Config.ADMISSION_RETRY_AFTER,
+                )
+    return _admission
@@ -0,0 +1,38 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+# Synchronous analyses run on a small per-process thread pool. Under
+# gunicorn's gthread workers the connection threads only read slow mobile
+# uploads and then wait here, so however many connections are open, at most
+# INFERENCE_THREADS analyses compete for the CPU and the pose estimators.
+# OpenCV, MediaPipe and numpy release the GIL while they work, so these
+# threads do run in parallel.
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_inference_executor():
+    # Threads do not survive a fork, so each worker starts its own pool
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=Config.INFERENCE_THREADS, thread_name_prefix="inference"
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def run_inference(func, *args, **kwargs):
+    # Blocks the calling request thread until func has run on the pool, in a
+    # copy of the caller's context so stage timings land on its request
+    if Config.INFERENCE_THREADS <= 0:
+        return func(*args, **kwargs)
+    context = contextvars.copy_context()
+    return get_inference_executor().submit(context.run, func, *args, **kwargs).result()
@@ -0,0 +1,365 @@
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+QUEUED = "queued"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+INTERRUPTED = "Job was interrupted before it finished, please upload again"
+COLUMNS = (
+    "job_id",
+    "kind",
+    "status",
+    "result",
+    "error",
+    "created_at",
+    "updated_at",
+    "owner_pid",
+    "upload_path",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryJobStore:
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, kind, upload_path=None):
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "kind": kind,
+                "status": QUEUED,
+                "result": None,
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+                "owner_pid": os.getpid(),
+                "upload_path": upload_path,
+            }
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields, updated_at=time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def queued_jobs(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values() if job["status"] == QUEUED]
+
+    def purge(self, finished_before):
+        with self._lock:
+            expired = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job["status"] in FINISHED_STATES and job["updated_at"] < finished_before
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+# Job state shared by every server process on the box, so a job can be polled
+# from any gunicorn worker, not only the one that accepted the upload. The
+# work itself runs in the pool of the process that accepted it (owner_pid).
+class SQLiteJobStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    owner_pid INTEGER,
+                    upload_path TEXT
+                )
+                """
+            )
+            # Databases created before jobs recorded their owner
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner_pid", "INTEGER"), ("upload_path", "TEXT")):
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, job_id, kind, upload_path=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs"
+                " (job_id, kind, status, created_at, updated_at, owner_pid, upload_path)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, now, now, os.getpid(), upload_path),
+            )
+
+    def update(self, job_id, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {columns} WHERE job_id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def _job(self, row):
+        job = dict(zip(COLUMNS, row))
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def get(self, job_id):
+        row = (
+            self._connect()
+            .execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,))
+            .fetchone()
+        )
+        return self._job(row) if row is not None else None
+
+    def queued_jobs(self):
+        rows = (
+            self._connect()
+            .execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE status = ?", (QUEUED,))
+            .fetchall()
+        )
+        return [self._job(row) for row in rows]
+
+    def purge(self, finished_before):
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*FINISHED_STATES, finished_before),
+            )
+
+
+def _init_worker():
+    # Runs once per pool process: build the pose estimators and load the pro
+    # pose index before the first job arrives
+    from media_processing.image_processor import warm_up_pose_pool
+    from ml.registry import preload
+
+    warm_up_pose_pool()
+    preload()
+
+
+def remove_upload(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def run_video_job(file_path, player, sampling, content_hash=None, remove_file=False):
+    from metrics import collect_stages, format_stages
+    from ml.registry import get_calculator
+    from ml.video_analysis import process_video
+
+    timings = {}
+    try:
+        with collect_stages() as timings:
+            return process_video(
+                file_path, get_calculator(), player, content_hash=content_hash, **sampling
+            )
+    finally:
+        logger.info("Video job stages: %s", format_stages(timings) or "none")
+        if remove_file:
+            remove_upload(file_path)
+
+
+class JobQueue:
+    def __init__(self, store, workers=2, start_method="spawn", result_ttl=3600, job_timeout=1800):
+        self.store = store
+        self.workers = workers
+        self.start_method = start_method
+        # Finished jobs, results included, are deleted after this many seconds
+        self.result_ttl = result_ttl
+        # Queued jobs older than this, or whose owning process is gone, are
+        # failed and their uploads deleted
+        self.job_timeout = job_timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+        # Jobs left behind by a restarted or killed server process
+        self.fail_stale_jobs()
+
+    def _get_executor(self, replace_broken=False):
+        # The pool is only started when the first job is submitted, and is
+        # replaced if a worker died and took the pool down with it
+        with self._lock:
+            if self._executor is not None and replace_broken:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def _purge_expired(self):
+        # At most once a minute, piggybacked on submissions
+        now = time.time()
+        if now - self._purged_at < 60:
+            return
+        self._purged_at = now
+        self.fail_stale_jobs()
+        if self.result_ttl > 0:
+            self.store.purge(now - self.result_ttl)
+
+    def _is_stale(self, job):
+        # The pool running a job lives in the process that accepted it, so
+        # once that process is gone the job can never finish
+        if job["status"] != QUEUED:
+            return False
+        if self.job_timeout > 0 and time.time() - job["created_at"] > self.job_timeout:
+            return True
+        owner = job.get("owner_pid")
+        return owner is not None and owner != os.getpid() and not process_alive(owner)
+
+    def _fail_stale(self, job):
+        logger.warning("Job %s was interrupted, marking it failed", job["job_id"])
+        self.store.update(job["job_id"], status=FAILED, error=INTERRUPTED)
+        if job.get("upload_path"):
+            remove_upload(job["upload_path"])
+
+    def fail_stale_jobs(self):
+        for job in self.store.queued_jobs():
+            if self._is_stale(job):
+                self._fail_stale(job)
+
+    def submit(self, kind, func, *args, on_result=None, on_failure=None, upload_path=None):
+        # on_failure runs when the job never ran to completion in a worker,
+        # e.g. because the pool broke; it releases what the job would have.
+        # upload_path is deleted if the job is found stale instead.
+        self._purge_expired()
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id, kind, upload_path)
+        try:
+            try:
+                future = self._get_executor().submit(func, *args)
+            except BrokenProcessPool:
+                future = self._get_executor(replace_broken=True).submit(func, *args)
+        except Exception as e:
+            logger.exception("Submitting job %s failed", job_id)
+            self.store.update(job_id, status=FAILED, error=str(e))
+            if on_failure is not None:
+                on_failure()
+            raise
+        future.add_done_callback(lambda f: self._finish(job_id, f, on_result, on_failure))
+        return job_id
+
+    def submit_video(
+        self, file_path, player, sampling=None, content_hash=None, on_result=None, remove_file=False
+    ):
+        return self.submit(
+            "video",
+            run_video_job,
+            file_path,
+            player,
+            sampling or {},
+            content_hash,
+            remove_file,
+            on_result=on_result,
+            on_failure=(lambda: remove_upload(file_path)) if remove_file else None,
+            upload_path=file_path if remove_file else None,
+        )
+
+    def _finish(self, job_id, future, on_result, on_failure=None):
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error("Job %s failed: %s", job_id, e)
+            self.store.update(job_id, status=FAILED, error=str(e))
+            if on_failure is not None:
+                on_failure()
+            return
+
+        if "error" in result:
+            self.store.update(job_id, status=FAILED, error=result["error"], result=result)
+            return
+        if on_result is not None:
+            result = on_result(result)
+        self.store.update(job_id, status=DONE, result=result)
+
+    def get(self, job_id):
+        job = self.store.get(job_id)
+        if job is not None and self._is_stale(job):
+            self._fail_stale(job)
+            job = self.store.get(job_id)
+        return job
+
+    def wait(self, job_id, timeout=0, interval=0.25):
+        # Long-poll: return as soon as the job finishes or the timeout expires
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and job["status"] not in FINISHED_STATES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+            job = self.get(job_id)
+        return job
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def create_job_queue(config):
+    if config.JOB_BACKEND == "sqlite":
+        store = SQLiteJobStore(config.JOB_DB_PATH)
+    else:
+        store = MemoryJobStore()
+    return JobQueue(
+        store,
+        workers=config.JOB_WORKERS,
+        start_method=config.JOB_START_METHOD,
+        result_ttl=config.JOB_RESULT_TTL,
+        job_timeout=config.JOB_TIMEOUT,
+    )
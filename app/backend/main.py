@@ -1,81 +1,294 @@
-import os
+import logging
 import random
-import sys
+import time
 
-import cv2
-from flask import Blueprint, Flask, current_app, jsonify, request, url_for
-from ml.analyze_shot import analyze_user_shot, calculator
-from werkzeug.utils import secure_filename
+import numpy as np
+from api.admin_routes import create_admin_bp
+from api.job_routes import create_jobs_bp
+from api.metrics_routes import create_metrics_bp
+from config import Config
+from flask import Blueprint, Flask, current_app, g, jsonify, request, url_for
+from jobs.admission import Overloaded, estimate_video_cost, get_admission
+from jobs.inference import run_inference
+from jobs.job_queue import create_job_queue
+from media_processing.image_processor import warm_up_pose_pool
+from media_processing.landmark_payload import (
+    check_landmarks,
+    decode_landmark_payload,
+    payload_size,
+)
+from media_processing.upload_ingest import IngestRequest, spool_upload
+from metrics import (
+    ANALYSES_TOTAL,
+    REQUEST_SECONDS,
+    begin_stages,
+    end_stages,
+    format_stages,
+    stage,
+)
+from ml.analyze_shot import (
+    KEY_JOINT_POINTS,
+    analyze_user_shot,
+    find_matching_player,
+    score_user_landmarks,
+)
+from ml.pro_library import get_library_updater, start_library_watcher
+from ml.registry import get_calculator, preload
+from ml.video_analysis import parse_sampling_options, process_video, score_video_landmarks
+from werkzeug.exceptions import HTTPException
 
-app = Flask(__name__)
-app.config["UPLOAD_FOLDER"] = "uploads"
+logger = logging.getLogger(__name__)
 
-@app.route("/")
 def hello_world():
     return "Hello, World!"
 
-def create_upload_bp(calculator):
+def build_upload_response(analysis_result):
+    return {
+        "message": "File uploaded and analyzed successfully",
+        "shot_id": f"shot_{random.randint(1000, 9999)}",
+        **analysis_result,
+    }
+
+def analyze_image_upload(spool, calculator, player, content_hash):
+    with stage("decode"):
+        image = spool.decode_image()
+    if image is None:
+        return {"error": "Could not decode image"}
+    return analyze_user_shot(image, calculator, player, content_hash=content_hash)
+
+def upload_too_large(error):
+    limit_mb = current_app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)
+    return jsonify({"error": f"File is too large (limit {limit_mb} MB)"}), 413
+
+def service_overloaded(error):
+    return jsonify({"error": error.description}), 503, {"Retry-After": str(error.retry_after)}
+
+def create_upload_bp(calculator=None, job_queue=None):
     upload_bp = Blueprint("upload_bp", __name__)
 
+    @upload_bp.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.stage_timings, g.stage_token = begin_stages()
+
+    @upload_bp.after_request
+    def record_request(response):
+        elapsed = time.perf_counter() - g.request_started
+        kind = g.get("analysis_kind", "unknown")
+        REQUEST_SECONDS.observe(
+            elapsed, route=request.endpoint or "", kind=kind, status=response.status_code
+        )
+        # Where this request spent its time, for the client and in the log
+        stages = format_stages(g.stage_timings)
+        if stages:
+            response.headers["Server-Timing"] = stages
+        logger.info(
+            "%s %s (%s) took %.3f s: %s",
+            request.endpoint,
+            response.status_code,
+            kind,
+            elapsed,
+            stages or "no stages",
+        )
+        return response
+
+    @upload_bp.teardown_request
+    def record_stages(error):
+        if "stage_token" in g:
+            end_stages(g.stage_timings, g.stage_token)
+
     @upload_bp.route("", methods=["POST"])
     def upload_media():
-        print("Received analyze request")
+        logger.info("Received analyze request")
         try:
-            player = request.form.get("player", "").strip()
-            is_video = request.form.get("is_video", "false").lower() == "true"
+            # Resolved once per request: the same library snapshot is used
+            # throughout even if a reload swaps in a new one meanwhile
+            active_calculator = calculator if calculator is not None else get_calculator()
+            # The body is streamed into upload spools while the form is parsed
+            with stage("upload"):
+                form = request.form
+                files = request.files
+            player = form.get("player", "").strip()
+            is_video = form.get("is_video", "false").lower() == "true"
+            run_async = form.get("async", str(Config.ASYNC_VIDEO_UPLOADS)).lower() == "true"
+            g.analysis_kind = "video" if is_video else "image"
 
-            print(f"Received player: {player}")
-            print(f"Is video: {is_video}")
+            logger.debug("Received player: %s, is video: %s", player, is_video)
 
             if not player:
-                print("Player name is missing or empty")
+                logger.info("Player name is missing or empty")
                 return jsonify({"error": "Player name is required"}), 400
 
-            if "file" not in request.files:
-                print("No file part in the request")
+            if "file" not in files:
+                logger.info("No file part in the request")
                 return jsonify({"error": "No file part"}), 400
 
-            file = request.files["file"]
+            file = files["file"]
 
             if file.filename == "":
-                print("No selected file")
+                logger.info("No selected file")
                 return jsonify({"error": "No selected file"}), 400
 
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                upload_folder = current_app.config["UPLOAD_FOLDER"]
-
-                # Ensure the upload folder exists
-                os.makedirs(upload_folder, exist_ok=True)
+                # Already streamed to memory or a unique file in the upload
+                # folder while the request was parsed; removed on teardown
+                spool = spool_upload(
+                    file,
+                    current_app.config["UPLOAD_FOLDER"],
+                    current_app.config["UPLOAD_MEMORY_BYTES"],
+                )
+                logger.debug("Received %d bytes", spool.size)
+                # Re-uploads of the same bytes reuse cached pose landmarks
+                content_hash = spool.content_hash
+                try:
+                    sampling = parse_sampling_options(form) if is_video else {}
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
 
-                file_path = os.path.join(upload_folder, filename)
-                file.save(file_path)
-                print(f"File saved to {file_path}")
+                if is_video and run_async and job_queue is not None:
+                    # Hand the video to the worker pool and answer right away;
+                    # the job deletes the file when it is done
+                    job_id = job_queue.submit_video(
+                        spool.detach(),
+                        player,
+                        sampling,
+                        content_hash=content_hash,
+                        on_result=build_upload_response,
+                        remove_file=True,
+                    )
+                    logger.info("Queued video analysis job %s", job_id)
+                    return (
+                        jsonify(
+                            {
+                                "message": "File uploaded and queued for analysis",
+                                "job_id": job_id,
+                                "status_url": url_for("jobs_bp.get_job", job_id=job_id),
+                            }
+                        ),
+                        202,
+                    )
 
-                print("Starting analysis...")
+                # Charged before any decoding; raises Overloaded (503) when
+                # the process is already busy enough
+                cost = 1.0
                 if is_video:
-                    analysis_result = process_video(file_path, calculator, player)
-                else:
-                    analysis_result = analyze_user_shot(file_path, calculator, player)
-                print("Analysis completed")
-                print(f"Analysis result: {analysis_result}")
+                    try:
+                        cost = estimate_video_cost(spool.to_path(), **sampling)
+                    except ValueError:
+                        # Unreadable container, process_video reports it
+                        pass
+
+                logger.debug("Starting analysis...")
+                with get_admission().admit(g.analysis_kind, cost):
+                    # On the bounded inference pool, not this connection thread
+                    if is_video:
+                        analysis_result = run_inference(
+                            process_video,
+                            spool.to_path(),
+                            active_calculator,
+                            player,
+                            content_hash=content_hash,
+                            **sampling,
+                        )
+                    else:
+                        analysis_result = run_inference(
+                            analyze_image_upload, spool, active_calculator, player, content_hash
+                        )
+                # Whole result dicts are large for videos, only log them on request
+                logger.debug("Analysis result: %s", analysis_result)
 
                 if "error" in analysis_result:
+                    ANALYSES_TOTAL.inc(player="unknown", kind=g.analysis_kind, outcome="error")
                     return jsonify(analysis_result), 400
 
-                response_data = {
-                    "message": "File uploaded and analyzed successfully",
-                    "shot_id": f"shot_{random.randint(1000, 9999)}",
-                    **analysis_result,
-                }
+                response_data = build_upload_response(analysis_result)
+                ANALYSES_TOTAL.inc(
+                    player=find_matching_player(active_calculator, player) or "unknown",
+                    kind=g.analysis_kind,
+                    outcome="ok",
+                )
 
-                print(f"Sending response: {response_data}")
-                return jsonify(response_data), 200
+                with stage("serialization"):
+                    response = jsonify(response_data)
+                return response, 200
 
-            print("File type not allowed")
+            logger.info("File type not allowed")
             return jsonify({"error": "File type not allowed"}), 400
+        except HTTPException:
+            # 413 and 503 are answered by their error handlers
+            raise
+        except Exception as e:
+            logger.exception("Unexpected error in analyze_shot")
+            return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+    @upload_bp.route("/landmarks", methods=["POST"])
+    def upload_landmarks():
+        # Pose estimated on the device: the "landmarks" part holds a payload
+        # as described in media_processing/landmark_payload.py, and the
+        # server only checks and scores it. No decode, inference or
+        # admission needed, so /upload remains the fallback for raw media.
+        logger.info("Received landmark analyze request")
+        g.analysis_kind = "landmarks"
+        try:
+            active_calculator = calculator if calculator is not None else get_calculator()
+            with stage("upload"):
+                form = request.form
+                files = request.files
+            player = form.get("player", "").strip()
+            if not player:
+                return jsonify({"error": "Player name is required"}), 400
+            if "landmarks" not in files:
+                return jsonify({"error": "No landmarks part"}), 400
+
+            spool = spool_upload(
+                files["landmarks"],
+                current_app.config["UPLOAD_FOLDER"],
+                current_app.config["UPLOAD_MEMORY_BYTES"],
+            )
+            if spool.size > payload_size(Config.LANDMARK_UPLOAD_MAX_FRAMES):
+                return jsonify({"error": "Landmark payload is too large"}), 400
+            try:
+                detail = parse_sampling_options(form).get("detail", Config.VIDEO_RESPONSE_DETAIL)
+                landmarks, visibility, timestamps = decode_landmark_payload(spool.read())
+                keep = check_landmarks(
+                    landmarks, visibility, timestamps, np.unique(KEY_JOINT_POINTS)
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            if not keep.any():
+                return jsonify({"error": "No frame has a usable pose"}), 400
+
+            # Same dtype as landmarks posed on the server
+            landmarks = landmarks.astype(np.float64)
+            if len(landmarks) == 1:
+                analysis_result = score_user_landmarks(landmarks[0], active_calculator, player)
+            else:
+                # Frames are numbered by their position in the payload
+                span = float(timestamps[-1] - timestamps[0])
+                fps = (len(timestamps) - 1) / span if span > 0 else None
+                analysis_result = score_video_landmarks(
+                    [(int(i), landmarks[i]) for i in np.flatnonzero(keep)],
+                    active_calculator,
+                    player,
+                    detail,
+                    fps,
+                )
+
+            if "error" in analysis_result:
+                ANALYSES_TOTAL.inc(player="unknown", kind=g.analysis_kind, outcome="error")
+                return jsonify(analysis_result), 400
+            ANALYSES_TOTAL.inc(
+                player=find_matching_player(active_calculator, player) or "unknown",
+                kind=g.analysis_kind,
+                outcome="ok",
+            )
+            with stage("serialization"):
+                response = jsonify(build_upload_response(analysis_result))
+            return response, 200
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"Unexpected error in analyze_shot: {str(e)}")
+            logger.exception("Unexpected error in upload_landmarks")
             return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
     return upload_bp
@@ -84,58 +297,44 @@ def allowed_file(filename):
     ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "mp4", "mov", "avi"}
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_video(video_path, calculator, player):
-    try:
-        cap = cv2.VideoCapture(video_path)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        
-        # Process every 30th frame or adjust as needed
-        interval = 30
-        results = []
-        
-        for i in range(0, frame_count, interval):
-            cap.set(cv2.CAP_PROP_POS_FRAMES, i)
-            ret, frame = cap.read()
-            if ret:
-                # Save frame as temporary image
-                temp_image_path = f"temp_frame_{i}.jpg"
-                cv2.imwrite(temp_image_path, frame)
-                
-                try:
-                    # Analyze the frame
-                    frame_result = analyze_user_shot(temp_image_path, calculator, player)
-                    if 'similarity_score' not in frame_result:
-                        print(f"Warning: similarity_score not found in frame result for frame {i}")
-                        continue
-                    results.append(frame_result)
-                except Exception as e:
-                    print(f"Error analyzing frame {i}: {str(e)}")
-                finally:
-                    # Remove temporary image
-                    os.remove(temp_image_path)
-        
-        cap.release()
-        
-        if not results:
-            return {"error": "No valid frames could be analyzed in the video"}
-        
-        # Aggregate results
-        valid_scores = [r['similarity_score'] for r in results if 'similarity_score' in r]
-        if not valid_scores:
-            return {"error": "No valid similarity scores found in the video analysis"}
-        
-        final_result = {
-            "average_similarity_score": sum(valid_scores) / len(valid_scores),
-            "frame_results": results
-        }
-        
-        return final_result
-    except Exception as e:
-        print(f"Error in process_video: {str(e)}")
-        return {"error": f"An error occurred while processing the video: {str(e)}"}
-
-app.register_blueprint(create_upload_bp(calculator), url_prefix="/upload")
+def create_app(config=Config):
+    logging.basicConfig(
+        level=logging.DEBUG if config.VERBOSE_LOGGING else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    app = Flask(__name__)
+    app.request_class = IngestRequest
+    app.config["UPLOAD_FOLDER"] = config.UPLOAD_FOLDER
+    app.config["UPLOAD_MEMORY_BYTES"] = config.UPLOAD_MEMORY_BYTES
+    # Werkzeug stops reading the body and answers 413 past this size
+    app.config["MAX_CONTENT_LENGTH"] = config.MAX_CONTENT_LENGTH
+    app.add_url_rule("/", view_func=hello_world)
+    app.register_error_handler(413, upload_too_large)
+    app.register_error_handler(Overloaded, service_overloaded)
+
+    job_queue = create_job_queue(config)
+    app.extensions["job_queue"] = job_queue
+
+    app.register_blueprint(create_upload_bp(job_queue=job_queue), url_prefix="/upload")
+    app.register_blueprint(create_jobs_bp(job_queue, config.JOB_MAX_WAIT), url_prefix="/jobs")
+    app.register_blueprint(create_metrics_bp(), url_prefix="/metrics")
+    if config.ADMIN_TOKEN:
+        app.register_blueprint(
+            create_admin_bp(get_library_updater(), config.ADMIN_TOKEN), url_prefix="/admin"
+        )
+
+    # Load the pro pose library now rather than on the first request. Under
+    # gunicorn with preload_app this happens once in the master, before fork.
+    if config.PRELOAD_CALCULATOR:
+        preload()
+
+    return app
 
 if __name__ == "__main__":
+    # Only here and in the WSGI server, so importing main builds nothing.
+    # gunicorn calls the factory itself: gunicorn 'main:create_app()'
+    app = create_app()
+    # Build the pose estimators before the first request arrives
+    warm_up_pose_pool()
+    start_library_watcher()
     app.run(debug=True, host='0.0.0.0', port=8000)
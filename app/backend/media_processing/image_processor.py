@@ -1,22 +1,333 @@
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
 import cv2
-import mediapipe as mp
 import numpy as np
+from config import Config
+from metrics import stage
 
-mp_pose = mp.solutions.pose
-mp_drawing = mp.solutions.drawing_utils
+logger = logging.getLogger(__name__)
 
+_mp_pose = None
 
-def extract_pose_landmarks(image_path):
-    image = cv2.imread(image_path)
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-    with mp_pose.Pose(static_image_mode=True, min_detection_confidence=0.5) as pose:
-        results = pose.process(image_rgb)
+def get_mp_pose():
+    # mediapipe takes over a second to import, so only pay for it once pose
+    # inference is actually needed
+    global _mp_pose
+    if _mp_pose is None:
+        import mediapipe as mp
 
-    if results.pose_landmarks:
-        landmarks = np.array(
-            [[lm.x, lm.y, lm.z] for lm in results.pose_landmarks.landmark]
-        )
+        _mp_pose = mp.solutions.pose
+    return _mp_pose
+
+
+# Building a Pose graph and loading its model costs more than running
+# inference, so estimators are created once and checked out per call.
+class PosePool:
+    def __init__(self, size=1, **pose_options):
+        self.size = max(1, int(size))
+        self.pose_options = pose_options
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Estimators hold native threads and cannot be shared across a fork,
+        # so a child process starts with an empty pool of its own.
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+
+    def _acquire(self, timeout=None):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+        if create:
+            try:
+                return get_mp_pose().Pose(**self.pose_options)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=timeout)
+
+    def _release(self, pose):
+        self._idle.put(pose)
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        pose = self._acquire(timeout)
+        try:
+            yield pose
+        finally:
+            self._release(pose)
+
+    def warm_up(self):
+        # Create every estimator up front and push a blank frame through each
+        # one so the first real request does not pay for graph start-up.
+        blank = np.zeros((256, 256, 3), dtype=np.uint8)
+        poses = [self._acquire() for _ in range(self.size)]
+        try:
+            for pose in poses:
+                pose.process(blank)
+        finally:
+            for pose in poses:
+                self._release(pose)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
+
+
+_pose_pool = None
+_pose_pool_lock = threading.Lock()
+
+
+def get_pose_pool():
+    global _pose_pool
+    if _pose_pool is None:
+        with _pose_pool_lock:
+            if _pose_pool is None:
+                _pose_pool = PosePool(
+                    size=Config.POSE_POOL_SIZE,
+                    static_image_mode=True,
+                    min_detection_confidence=0.5,
+                )
+    return _pose_pool
+
+
+_scan_pose_pool = None
+
+
+def get_scan_pose_pool():
+    # For quick low-resolution passes over a clip where only coarse joint
+    # positions matter. model_complexity=0 (lite) is fastest but is not
+    # bundled with the mediapipe wheel and is downloaded on first use.
+    global _scan_pose_pool
+    if _scan_pose_pool is None:
+        with _pose_pool_lock:
+            if _scan_pose_pool is None:
+                _scan_pose_pool = PosePool(
+                    size=Config.POSE_POOL_SIZE,
+                    static_image_mode=True,
+                    model_complexity=Config.PHASE_SCAN_MODEL_COMPLEXITY,
+                    min_detection_confidence=0.5,
+                )
+    return _scan_pose_pool
+
+
+_tracking_pose_pool = None
+
+
+def get_tracking_pose_pool():
+    # Video-mode estimators: after the first detection they track the person
+    # from the previous frame's region instead of detecting on every frame
+    global _tracking_pose_pool
+    if _tracking_pose_pool is None:
+        with _pose_pool_lock:
+            if _tracking_pose_pool is None:
+                _tracking_pose_pool = PosePool(
+                    size=Config.POSE_POOL_SIZE,
+                    static_image_mode=False,
+                    smooth_landmarks=True,
+                    min_detection_confidence=0.5,
+                    min_tracking_confidence=Config.POSE_TRACKING_CONFIDENCE,
+                )
+    return _tracking_pose_pool
+
+
+def warm_up_pose_pool():
+    pool = get_pose_pool()
+    pool.warm_up()
+    logger.info("Pose pool warmed up with %d estimator(s)", pool.size)
+    return pool
+
+
+def load_image(image):
+    # Accept either a path on disk or an already decoded BGR frame
+    if image is None:
+        raise ValueError("Could not decode image")
+    if isinstance(image, np.ndarray):
+        return image
+    decoded = cv2.imread(os.fspath(image))
+    if decoded is None:
+        raise ValueError("Could not decode image")
+    return decoded
+
+
+def pose_input(image, max_side=None, roi=None):
+    # MediaPipe runs its models at 256x256 or less, so a 4K frame only costs
+    # more to convert and resize. Crop to roi (x0, y0, x1, y1 in pixels),
+    # shrink so the longer side is at most max_side, and convert to RGB last
+    # so the conversion runs on the small image. Returns the RGB image and
+    # the region it covers, for remap_landmarks.
+    height, width = image.shape[:2]
+    x0, y0, x1, y1 = roi or (0, 0, width, height)
+    region = image[y0:y1, x0:x1]
+    if max_side is None:
+        max_side = Config.POSE_INFERENCE_MAX_SIDE
+    scale = max_side / max(region.shape[:2]) if max_side else 1.0
+    if scale < 1.0:
+        size = (max(1, round(region.shape[1] * scale)), max(1, round(region.shape[0] * scale)))
+        region = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(region, cv2.COLOR_BGR2RGB), (x0, y0, x1 - x0, y1 - y0, width, height)
+
+
+def remap_landmarks(landmarks, region):
+    # Landmarks are normalized to the image MediaPipe saw; map them back to
+    # the full frame. Downscaling alone leaves normalized coordinates as-is.
+    if landmarks is None:
+        return None
+    x0, y0, region_width, region_height, width, height = region
+    if (region_width, region_height) == (width, height):
         return landmarks
-    else:
+    remapped = np.empty_like(landmarks)
+    remapped[:, 0] = (x0 + landmarks[:, 0] * region_width) / width
+    remapped[:, 1] = (y0 + landmarks[:, 1] * region_height) / height
+    # z uses roughly the same scale as x
+    remapped[:, 2] = landmarks[:, 2] * region_width / width
+    return remapped
+
+
+def pose_roi(landmarks, shape, margin=None):
+    # Region around a pose found in an earlier frame, grown by margin times
+    # the pose's size on every side to allow for movement in between.
+    # Returns None when the region would cover most of the frame anyway.
+    if landmarks is None:
         return None
+    if margin is None:
+        margin = Config.POSE_ROI_MARGIN
+    height, width = shape[:2]
+    xs = np.clip(landmarks[:, 0], 0, 1) * width
+    ys = np.clip(landmarks[:, 1], 0, 1) * height
+    pad = margin * max(xs.max() - xs.min(), ys.max() - ys.min())
+    x0, x1 = int(max(0, xs.min() - pad)), int(min(width, np.ceil(xs.max() + pad)))
+    y0, y1 = int(max(0, ys.min() - pad)), int(min(height, np.ceil(ys.max() + pad)))
+    if x1 - x0 < 2 or y1 - y0 < 2 or (x1 - x0) * (y1 - y0) > 0.8 * width * height:
+        return None
+    return x0, y0, x1, y1
+
+
+def landmarks_from_results(results):
+    if not results.pose_landmarks:
+        return None, None
+    landmarks = results.pose_landmarks.landmark
+    return (
+        np.array([[lm.x, lm.y, lm.z] for lm in landmarks]),
+        np.array([lm.visibility for lm in landmarks]),
+    )
+
+
+# Holds one tracking estimator for the whole stream. Use as a context manager
+# and feed frames in order with process(frame, frame_index). Frames within
+# max_frame_gap of the previous one are tracked; frames further apart, and
+# frames where the person was lost mid-track, are detected again with the
+# static estimators, cropped to the region around the last pose found.
+class VideoPoseTracker:
+    def __init__(self, max_frame_gap=None, pool=None):
+        self.pool = pool or get_tracking_pose_pool()
+        self.max_frame_gap = max_frame_gap or Config.POSE_TRACKING_MAX_GAP
+        self.fallbacks = 0
+        self._pose = None
+        self._checkout = None
+        self._last_index = None
+        self._last_landmarks = None
+        self._tracking = False
+
+    def __enter__(self):
+        self._checkout = self.pool.checkout()
+        self._pose = self._checkout.__enter__()
+        # Drop any tracking state left over from the previous stream
+        self._pose.reset()
+        self._last_index = None
+        self._last_landmarks = None
+        self._tracking = False
+        return self
+
+    def __exit__(self, *exc_info):
+        self._checkout.__exit__(*exc_info)
+        self._checkout = None
+        self._pose = None
+
+    def process(self, frame, frame_index=None):
+        # Returns (landmarks, visibility) or (None, None)
+        gap = (
+            frame_index is not None
+            and self._last_index is not None
+            and frame_index - self._last_index > self.max_frame_gap
+        )
+        self._last_index = frame_index
+        if gap:
+            # Too far apart to track between; the estimator starts over on
+            # the next frame that is close enough
+            self._pose.reset()
+            self._tracking = False
+            return self._detect(frame)
+
+        # Downscale only: the tracker follows the person from its own region
+        # of the previous frame, which a moving crop would invalidate
+        with stage("preprocess"):
+            image_rgb, _ = pose_input(frame)
+        with stage("pose"):
+            results = self._pose.process(image_rgb)
+        landmarks, visibility = landmarks_from_results(results)
+        if landmarks is not None:
+            self._tracking = True
+            self._last_landmarks = landmarks
+            return landmarks, visibility
+        if not self._tracking:
+            # The estimator already ran a full detection on this frame
+            return None, None
+
+        # Lost mid-track: the estimator would only detect again on the next
+        # frame, so detect on this one now
+        self._pose.reset()
+        self._tracking = False
+        self.fallbacks += 1
+        return self._detect(frame)
+
+    def _detect(self, frame):
+        roi = None
+        if Config.POSE_ROI_CROP:
+            roi = pose_roi(self._last_landmarks, frame.shape)
+        landmarks, visibility = detect_pose(frame, roi=roi)
+        if landmarks is not None:
+            self._last_landmarks = landmarks
+        return landmarks, visibility
+
+
+def detect_pose(image, pool=None, roi=None):
+    # Static detection; returns (landmarks, visibility) or (None, None). With
+    # roi (see pose_roi) only that region is posed, falling back to the whole
+    # frame when nobody is found in it. Landmarks are always relative to the
+    # full image.
+    image = load_image(image)
+    with stage("preprocess"):
+        image_rgb, region = pose_input(image, roi=roi)
+
+    with (pool or get_pose_pool()).checkout() as pose, stage("pose"):
+        results = pose.process(image_rgb)
+        if not results.pose_landmarks and roi is not None:
+            image_rgb, region = pose_input(image)
+            results = pose.process(image_rgb)
+
+    landmarks, visibility = landmarks_from_results(results)
+    return remap_landmarks(landmarks, region), visibility
+
+
+def extract_pose_landmarks(image, pool=None, roi=None):
+    return detect_pose(image, pool, roi)[0]
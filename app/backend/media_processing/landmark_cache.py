@@ -0,0 +1,225 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from config import Config
+from media_processing.image_processor import extract_pose_landmarks
+
+logger = logging.getLogger(__name__)
+
+# Bump when extraction code changes in a way that invalidates stored
+# landmarks; configuration is part of every key (see extraction_settings)
+CACHE_VERSION = 3
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extraction_settings():
+    # Every setting that changes which landmarks extraction produces, so
+    # that changing one misses the cache instead of serving stale entries
+    return {
+        "max_side": Config.POSE_INFERENCE_MAX_SIDE,
+        "roi_crop": Config.POSE_ROI_CROP,
+        "roi_margin": Config.POSE_ROI_MARGIN,
+        "tracking": Config.VIDEO_POSE_TRACKING,
+        "tracking_confidence": Config.POSE_TRACKING_CONFIDENCE,
+        "tracking_max_gap": Config.POSE_TRACKING_MAX_GAP,
+        "min_visibility": Config.MIN_KEY_JOINT_VISIBILITY,
+    }
+
+
+def cache_key(content_hash, kind, **options):
+    # Landmarks depend on the uploaded bytes, on how frames were sampled and
+    # on the extraction settings, never on the player they are scored against
+    options = {**extraction_settings(), **options}
+    parts = [f"v{CACHE_VERSION}", kind, content_hash]
+    parts.extend(f"{name}={options[name]}" for name in sorted(options))
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def _read_only(entry):
+    # Entries are shared by every caller that hits the memory tier
+    for array in entry:
+        array.flags.writeable = False
+    return entry
+
+
+# Two tiers of frame landmarks keyed by content: a small in-memory LRU per
+# process in front of a size-bounded directory shared by every process.
+# Entries are (frame_indices, landmarks) with landmarks shaped (N, 33, 3);
+# N == 0 records that no pose was found so failures are cached too.
+class LandmarkCache:
+    def __init__(self, directory, max_disk_bytes, max_memory_bytes):
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._disk_bytes = self._scan_disk_bytes()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                entry = _read_only((data["frame_indices"], data["landmarks"]))
+            # Recency for disk eviction is the file's mtime
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, frame_indices, landmarks):
+        # Copies, so the caller's arrays stay writable
+        entry = _read_only(
+            (
+                np.array(frame_indices, dtype=np.int64),
+                np.array(landmarks, dtype=np.float64).reshape(-1, 33, 3),
+            )
+        )
+        self._remember(key, entry)
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, frame_indices=entry[0], landmarks=entry[1])
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write landmark cache entry %s: %s", key, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._disk_bytes += os.path.getsize(path)
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _remember(self, key, entry):
+        size = entry[0].nbytes + entry[1].nbytes
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= old[0].nbytes + old[1].nbytes
+            self._memory[key] = entry
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted[0].nbytes + evicted[1].nbytes
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".npz"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_mtime, stat.st_size
+
+    def _scan_disk_bytes(self):
+        return sum(size for _, _, size in self._entries())
+
+    def _evict_disk(self):
+        # Other processes share the directory, so re-scan rather than trust the
+        # local running total, then drop least recently used files down to 90%
+        # of the budget
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        target = self.max_disk_bytes * 0.9
+        for path, _, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+
+_landmark_cache = None
+_landmark_cache_lock = threading.Lock()
+
+
+def get_landmark_cache():
+    global _landmark_cache
+    if not Config.LANDMARK_CACHE_ENABLED:
+        return None
+    if _landmark_cache is None:
+        with _landmark_cache_lock:
+            if _landmark_cache is None:
+                _landmark_cache = LandmarkCache(
+                    Config.LANDMARK_CACHE_DIR,
+                    Config.LANDMARK_CACHE_MAX_BYTES,
+                    Config.LANDMARK_CACHE_MEMORY_BYTES,
+                )
+    return _landmark_cache
+
+
+def extract_pose_landmarks_cached(image, content_hash=None):
+    cache = get_landmark_cache() if content_hash else None
+    if cache is None:
+        return extract_pose_landmarks(image)
+
+    key = cache_key(content_hash, "image")
+    entry = cache.get(key)
+    if entry is not None:
+        landmarks = entry[1]
+        return landmarks[0] if len(landmarks) else None
+
+    landmarks = extract_pose_landmarks(image)
+    if landmarks is None:
+        cache.put(key, [], np.empty((0, 33, 3)))
+    else:
+        cache.put(key, [0], landmarks[np.newaxis])
+    return landmarks
+
+
+def cached_frame_landmarks(content_hash, kind, options, compute):
+    # compute() returns [(frame_index, landmarks)]; the result is stored under
+    # the upload's content hash, the kind of pass and its options
+    cache = get_landmark_cache() if content_hash else None
+    if cache is None:
+        return compute()
+
+    key = cache_key(content_hash, kind, **options)
+    entry = cache.get(key)
+    if entry is not None:
+        return list(zip(entry[0].tolist(), entry[1]))
+
+    frame_landmarks = compute()
+    cache.put(
+        key,
+        [i for i, _ in frame_landmarks],
+        np.array([landmarks for _, landmarks in frame_landmarks]).reshape(-1, 33, 3),
+    )
+    return frame_landmarks
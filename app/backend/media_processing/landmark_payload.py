@@ -0,0 +1,111 @@
+import struct
+
+import numpy as np
+from config import Config
+from ml.pose_features import LEFT_HIP, LEFT_SHOULDER, RIGHT_HIP, RIGHT_SHOULDER
+
+# Compact landmark upload for clients that run MediaPipe Pose on the device
+# (POST /upload/landmarks); the server then only scores. Little-endian:
+#   header   4s magic b"JSLM", uint8 version, uint8 landmarks per frame (33),
+#            uint16 flags (0), uint32 frame count N
+#   float16  (N, 33, 3) landmarks in MediaPipe's normalized image
+#            coordinates (x and y relative to the frame, z relative to x)
+#   float16  (N, 33) visibility in [0, 1]
+#   float32  (N,) timestamps in seconds, non-decreasing
+# A 3 s clip at 15 fps is about 12 KB instead of megabytes of video.
+MAGIC = b"JSLM"
+VERSION = 1
+LANDMARK_COUNT = 33
+HEADER = struct.Struct("<4sBBHI")
+
+# MediaPipe extrapolates landmarks of limbs outside the frame well past 0-1
+# (the bundled pro poses reach y = 3.6). Key joints outside COORDINATE_RANGE
+# or past DEPTH_LIMIT only drop their frame; magnitudes over ABSURD_LIMIT,
+# such as pixel coordinates, reject the payload.
+COORDINATE_RANGE = (-3.5, 4.5)
+DEPTH_LIMIT = 5.0
+ABSURD_LIMIT = 20.0
+
+
+def payload_size(frames):
+    return HEADER.size + frames * LANDMARK_COUNT * (3 * 2 + 2) + frames * 4
+
+
+def encode_landmark_payload(landmarks, visibility=None, timestamps=None):
+    # Reference encoder, the inverse of decode_landmark_payload
+    landmarks = np.asarray(landmarks, dtype=np.float32).reshape(-1, LANDMARK_COUNT, 3)
+    frames = len(landmarks)
+    if visibility is None:
+        visibility = np.ones((frames, LANDMARK_COUNT), dtype=np.float32)
+    if timestamps is None:
+        timestamps = np.arange(frames, dtype=np.float32) / 30.0
+    return b"".join(
+        [
+            HEADER.pack(MAGIC, VERSION, LANDMARK_COUNT, 0, frames),
+            landmarks.astype("<f2").tobytes(),
+            np.asarray(visibility).astype("<f2").tobytes(),
+            np.asarray(timestamps).astype("<f4").tobytes(),
+        ]
+    )
+
+
+def decode_landmark_payload(data):
+    # -> (landmarks (N, 33, 3), visibility (N, 33), timestamps (N,)), all
+    # float32; raises ValueError with a client-facing message
+    if len(data) < HEADER.size:
+        raise ValueError("Landmark payload is too short")
+    magic, version, count, _, frames = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a landmark payload")
+    if version != VERSION:
+        raise ValueError(f"Unsupported landmark payload version {version}")
+    if count != LANDMARK_COUNT:
+        raise ValueError(f"Expected {LANDMARK_COUNT} landmarks per frame, got {count}")
+    if not 1 <= frames <= Config.LANDMARK_UPLOAD_MAX_FRAMES:
+        raise ValueError(
+            f"Frame count must be between 1 and {Config.LANDMARK_UPLOAD_MAX_FRAMES}"
+        )
+    if len(data) != payload_size(frames):
+        raise ValueError(f"Payload is {len(data)} bytes, expected {payload_size(frames)}")
+
+    offset = HEADER.size
+    landmarks = np.frombuffer(data, "<f2", frames * LANDMARK_COUNT * 3, offset)
+    offset += landmarks.nbytes
+    visibility = np.frombuffer(data, "<f2", frames * LANDMARK_COUNT, offset)
+    offset += visibility.nbytes
+    timestamps = np.frombuffer(data, "<f4", frames, offset)
+    return (
+        landmarks.astype(np.float32).reshape(frames, LANDMARK_COUNT, 3),
+        visibility.astype(np.float32).reshape(frames, LANDMARK_COUNT),
+        timestamps.astype(np.float32),
+    )
+
+
+def check_landmarks(landmarks, visibility, timestamps, key_joints):
+    # Rejects payloads that cannot come from MediaPipe (ValueError) and
+    # returns a mask of the frames worth scoring: key joints in a plausible
+    # range and visible enough, and a torso that has not collapsed to a point
+    if not (
+        np.isfinite(landmarks).all()
+        and np.isfinite(visibility).all()
+        and np.isfinite(timestamps).all()
+    ):
+        raise ValueError("Landmark payload contains NaN or infinite values")
+    if np.abs(landmarks).max() > ABSURD_LIMIT:
+        raise ValueError("Landmarks must be normalized image coordinates")
+    if visibility.min() < 0 or visibility.max() > 1:
+        raise ValueError("Visibility must be between 0 and 1")
+    if timestamps.min() < 0 or (np.diff(timestamps) < 0).any():
+        raise ValueError("Timestamps must be non-negative and non-decreasing")
+
+    low, high = COORDINATE_RANGE
+    key = landmarks[:, key_joints]
+    in_range = ((key[..., :2] >= low) & (key[..., :2] <= high)).all(axis=(1, 2)) & (
+        np.abs(key[..., 2]) <= DEPTH_LIMIT
+    ).all(axis=1)
+
+    hips = (landmarks[:, LEFT_HIP] + landmarks[:, RIGHT_HIP]) / 2
+    shoulders = (landmarks[:, LEFT_SHOULDER] + landmarks[:, RIGHT_SHOULDER]) / 2
+    torso = np.linalg.norm((shoulders - hips)[:, :2], axis=-1)
+    visible = visibility[:, key_joints].mean(axis=1) >= Config.MIN_KEY_JOINT_VISIBILITY
+    return in_range & visible & (torso >= Config.LANDMARK_MIN_TORSO)
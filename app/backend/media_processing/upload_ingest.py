@@ -0,0 +1,123 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+from flask import Request, current_app
+from werkzeug.utils import secure_filename
+
+
+class UploadSpool:
+    # Destination for one uploaded file part. Werkzeug's multipart parser
+    # writes the body into it chunk by chunk as it is read off the socket:
+    # small uploads stay in memory, larger ones roll over to a uniquely
+    # named file in the upload folder, so concurrent uploads of the same
+    # filename never collide. The sha256 is updated as chunks arrive, which
+    # saves the second read hash_file would need. close() deletes the file
+    # unless it was detach()ed for a background job.
+    def __init__(self, directory, suffix="", memory_limit=0):
+        self.directory = directory
+        self.suffix = suffix
+        self.memory_limit = memory_limit
+        self.size = 0
+        self.path = None
+        self._digest = hashlib.sha256()
+        self._file = io.BytesIO()
+        self._detached = False
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        if self.path is None and self.size > self.memory_limit:
+            self._rollover()
+        return self._file.write(data)
+
+    def _rollover(self):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="upload-", suffix=self.suffix, dir=self.directory)
+        spooled = self._file
+        self._file = os.fdopen(fd, "w+b")
+        self.path = path
+        self._file.write(spooled.getbuffer())
+        self._file.seek(spooled.tell())
+
+    def __getattr__(self, name):
+        # read, readline, seek, tell, ... for FileStorage and the parser
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    @property
+    def content_hash(self):
+        return self._digest.hexdigest()
+
+    @property
+    def in_memory(self):
+        return self.path is None
+
+    def to_path(self):
+        # OpenCV can only open videos by path, so this forces a rollover
+        if self.path is None:
+            self._rollover()
+        self._file.flush()
+        return self.path
+
+    def decode_image(self):
+        # Images are decoded straight from the spooled bytes when possible
+        if self.path is None:
+            return cv2.imdecode(np.frombuffer(self._file.getbuffer(), np.uint8), cv2.IMREAD_COLOR)
+        self._file.flush()
+        return cv2.imread(self.path)
+
+    def detach(self):
+        # Hands the file over to a background job, which must delete it
+        path = self.to_path()
+        self._detached = True
+        return path
+
+    def close(self):
+        self._file.close()
+        if self.path is not None and not self._detached:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class IngestRequest(Request):
+    # Flask request class that spools file parts into UploadSpool instead
+    # of werkzeug's anonymous temp files. Every spool is remembered here and
+    # closed with the request when its context is torn down, including the
+    # ones that never reach request.files because the client disconnected
+    # mid-body or parsing failed.
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        suffix = os.path.splitext(secure_filename(filename or ""))[1]
+        spool = UploadSpool(
+            current_app.config["UPLOAD_FOLDER"],
+            suffix,
+            current_app.config.get("UPLOAD_MEMORY_BYTES", 0),
+        )
+        self.__dict__.setdefault("_spools", []).append(spool)
+        return spool
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for spool in self.__dict__.pop("_spools", []):
+                spool.close()
+
+
+def spool_upload(file, directory, memory_limit=0, chunk_size=1024 * 1024):
+    # The UploadSpool behind a FileStorage, copying the stream into one
+    # when the app does not use IngestRequest
+    if isinstance(file.stream, UploadSpool):
+        return file.stream
+    spool = UploadSpool(directory, os.path.splitext(secure_filename(file.filename or ""))[1], memory_limit)
+    shutil.copyfileobj(file.stream, spool, chunk_size)
+    spool.seek(0)
+    return spool
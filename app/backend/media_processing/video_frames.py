@@ -0,0 +1,83 @@
+import logging
+import math
+
+import cv2
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def sampling_stride(fps, frame_count, stride=None, target_fps=None, max_frames=None):
+    # An explicit stride wins, otherwise derive one from the target fps,
+    # falling back to the configured default
+    for name, value in (("stride", stride), ("target_fps", target_fps), ("max_frames", max_frames)):
+        if value is not None and not value > 0:
+            raise ValueError(f"{name} must be a positive number")
+    if stride:
+        step = int(stride)
+    elif target_fps and fps > 0:
+        step = int(round(fps / float(target_fps)))
+    else:
+        step = Config.VIDEO_FRAME_STRIDE
+    step = max(1, step)
+
+    # Spread a frame budget over the whole clip instead of stopping early
+    if max_frames and frame_count > 0:
+        step = max(step, math.ceil(frame_count / int(max_frames)))
+    return step
+
+
+def read_video_info(video_path):
+    # Container metadata only, no frames are decoded
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        # The path is an upload spool on the server, keep it out of the
+        # message that reaches the client
+        logger.warning("Could not open video file %s", video_path)
+        raise ValueError("Could not open video file")
+    try:
+        return {
+            "fps": cap.get(cv2.CAP_PROP_FPS) or 0,
+            "frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        }
+    finally:
+        cap.release()
+
+
+def iter_video_frames(
+    video_path, stride=None, target_fps=None, max_frames=None, start=0, stop=None
+):
+    # Decode forward in a single pass. Skipped frames are only grabbed, which
+    # avoids both the per-sample keyframe seek of CAP_PROP_POS_FRAMES and the
+    # cost of converting frames we never look at. A frame range [start, stop)
+    # costs one seek to its first frame.
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        logger.warning("Could not open video file %s", video_path)
+        raise ValueError("Could not open video file")
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        step = sampling_stride(fps, frame_count, stride, target_fps, max_frames)
+
+        index = start
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        sampled = 0
+        while stop is None or index < stop:
+            if index % step == 0:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield index, frame
+                sampled += 1
+                if max_frames and sampled >= int(max_frames):
+                    break
+            elif not cap.grab():
+                break
+            index += 1
+    finally:
+        cap.release()
@@ -1,5 +1,7 @@
+import os
+
 from config import Config
-from database.firestore_manager import add_shot_analysis, update_user_stats
+from database.write_buffer import record_shot
 from flask import Blueprint, jsonify, request
 from media_processing import image_processor, video_processor
 from werkzeug.utils import secure_filename
@@ -40,24 +42,15 @@ def upload_media():
         else:
             return jsonify({"error": "Unsupported file type"}), 400
 
-        # Update user stats
-        update_user_stats(
-            user_id,
-            {
-                "total_shots": firestore.Increment(1),
-                "streak": firestore.Increment(1),
-                f"player_counts.{target_player}": firestore.Increment(1),
-            },
-        )
-
-        # Add shot analysis to user's history
-        shot_id = add_shot_analysis(
+        # Stats increment and shot document are buffered and committed to
+        # Firestore in batches, off the request path
+        shot_id = record_shot(
             user_id,
+            target_player,
             {
                 "file_path": file_path,
                 "target_player": target_player,
                 "analysis_result": analysis_result,
-                "timestamp": firestore.SERVER_TIMESTAMP,
             },
         )
 
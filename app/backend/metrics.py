@@ -0,0 +1,212 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal in-process metrics with Prometheus text exposition, so the
+# backend needs no extra dependency. Each process (gunicorn worker, job
+# worker) keeps its own values; stages that run in job or frame worker
+# processes are not visible on the web workers' /metrics.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labels, key, [("le", le)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "shot_request_seconds", "Analysis request latency", ("route", "kind", "status")
+)
+STAGE_SECONDS = Histogram(
+    "shot_stage_seconds",
+    "Time per request spent in each analysis stage"
+    " (upload, decode, preprocess, pose, scoring, serialization)",
+    ("stage",),
+)
+ANALYSES_TOTAL = Counter(
+    "shot_analyses_total", "Analyzed shots by matched player and outcome", ("player", "kind", "outcome")
+)
+FRAMES_TOTAL = Counter("shot_frames_total", "Video frames posed", ("outcome",))
+ADMISSION_IN_FLIGHT = Gauge(
+    "shot_admission_in_flight_cost", "Estimated cost of admitted analyses", ("kind",)
+)
+ADMISSION_QUEUED = Gauge(
+    "shot_admission_queue_depth", "Analyses waiting for admission", ("kind",)
+)
+ADMISSION_REJECTED = Counter(
+    "shot_admission_rejected_total", "Analyses turned away with 503", ("kind", "reason")
+)
+
+ALL_METRICS = [
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    ANALYSES_TOTAL,
+    FRAMES_TOTAL,
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUED,
+    ADMISSION_REJECTED,
+]
+
+
+# Stage times are summed per request (or job) and observed once each when it
+# ends, so every stage in STAGE_SECONDS counts whole requests, whether it ran
+# once (scoring) or per frame (decode, pose). Outside a request each call is
+# observed on its own.
+_stage_timings = contextvars.ContextVar("stage_timings", default=None)
+_stage_timings_lock = threading.Lock()
+
+
+def begin_stages():
+    # -> (timings, token); timings fills in as stages run in this context,
+    # including on the inference pool (see jobs/inference.py)
+    timings = {}
+    return timings, _stage_timings.set(timings)
+
+
+def end_stages(timings, token):
+    _stage_timings.reset(token)
+    for name, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+
+@contextmanager
+def collect_stages():
+    timings, token = begin_stages()
+    try:
+        yield timings
+    finally:
+        end_stages(timings, token)
+
+
+def format_stages(timings):
+    # Server-Timing header value, e.g. "decode;dur=12.3, pose;dur=80.1"
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+@contextmanager
+def stage(name):
+    # with stage("pose"): ...
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def observe_stage(name, seconds):
+    timings = _stage_timings.get()
+    if timings is None:
+        STAGE_SECONDS.observe(seconds, stage=name)
+        return
+    with _stage_timings_lock:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def timed_frames(frames, stage_name="decode"):
+    # Wraps a frame iterator and records the time spent producing each frame,
+    # which for iter_video_frames is the decode cost
+    iterator = iter(frames)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        observe_stage(stage_name, time.perf_counter() - start)
+        yield item
+
+
+def render_metrics():
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
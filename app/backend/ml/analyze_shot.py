@@ -1,59 +1,126 @@
+import logging
 import os
 import sys
 
 import numpy as np
-from scipy.spatial.distance import cosine
 
 # Add media_processing directory to the path for import
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from media_processing.image_processor import extract_pose_landmarks
+from media_processing.landmark_cache import extract_pose_landmarks_cached
+from config import Config
+from metrics import stage
+from ml.ann_index import IVFIndex
+from ml.pose_features import calculate_angles_batch, pose_features
+from ml.pose_index import ProPoseIndex
+from ml.pose_store import (
+    build_pose_store,
+    load_pose_store,
+    store_exists,
+)
+
+
+logger = logging.getLogger(__name__)
+
+KEY_JOINTS = [
+    ("Elbow", 13, 11, 15),  # Right elbow
+    ("Shoulder", 11, 13, 23),  # Right shoulder
+    ("Knee", 25, 23, 27),  # Right knee
+    ("Hip", 23, 25, 11),  # Right hip
+]
+KEY_JOINT_NAMES = [joint[0] for joint in KEY_JOINTS]
+KEY_JOINT_POINTS = np.array([joint[1:] for joint in KEY_JOINTS])
 
 
 class PoseSimilarityCalculator:
     def __init__(self):
         self.pro_poses = {}
+        self._index = None
+        self.ann = None
+        self.generation = None
+        self.store = None
+
+    @classmethod
+    def from_store(cls, store):
+        # Per-player lists are views into the memory-mapped store and the
+        # index uses the stored unit vectors directly, so nothing is copied
+        calculator = cls()
+        for player in store.players:
+            calculator.pro_poses[player] = list(store.player_poses(player))
+        calculator._index = store.to_index()
+        calculator.generation = store.generation
+        # Keeps the store's generation on disk while this calculator is used
+        calculator.store = store
+        return calculator
 
     def add_pro_pose(self, player_name, landmarks):
+        # Only for calculators still being built; the one the registry hands
+        # out is shared by request threads and replaced as a whole on reload
         if player_name not in self.pro_poses:
             self.pro_poses[player_name] = []
         self.pro_poses[player_name].append(landmarks)
-
-    def calculate_similarity(self, user_landmarks, player_name=None):
-        user_landmarks = np.asarray(user_landmarks).flatten()
-        if player_name and player_name in self.pro_poses:
-            poses = self.pro_poses[player_name]
-            similarities = [
-                1 - cosine(user_landmarks, pro_landmarks.flatten())
-                for pro_landmarks in poses
-            ]
-            return max(similarities)
+        # Rebuilt lazily on the next query
+        self._index = None
+        if self.ann is not None:
+            position = len(self.pro_poses[player_name]) - 1
+            self.ann.add(player_name, [position], pose_features(landmarks))
+
+    def enable_ann(self, path=None):
+        # Loads the persisted ANN index when it matches this library, else
+        # trains a new one and saves it for the next start
+        if path and os.path.exists(path):
+            ann = IVFIndex.load(path)
+            if (
+                ann.generation == self.generation
+                and len(ann) == len(self.index)
+                and ann.centroids.shape[1] == self.index.vectors.shape[1]
+            ):
+                self.ann = ann
+                return ann
+        ann = IVFIndex.build(self.index, Config.ANN_NLIST, Config.ANN_NPROBE)
+        ann.generation = self.generation
+        if path:
+            ann.save(path)
+        self.ann = ann
+        return ann
+
+    def use_ann(self):
+        return self.ann is not None and len(self.index) >= Config.ANN_MIN_POSES
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = ProPoseIndex.from_poses(self.pro_poses)
+        return self._index
+
+    def find_best_match(self, user_landmarks, player_name):
+        return self.index.best_match(user_landmarks, player_name)
+
+    def find_best_matches(self, user_landmarks_batch, player_name):
+        return self.index.best_matches(user_landmarks_batch, player_name)
+
+    def calculate_similarity(self, user_landmarks, player_name=None, match=None):
+        if match is not None:
+            return match.similarity
+        if player_name and player_name in self.index:
+            return self.find_best_match(user_landmarks, player_name).similarity
         else:
-            similarities = {}
-            for player, poses in self.pro_poses.items():
-                player_similarities = [
-                    1 - cosine(user_landmarks, pro_landmarks.flatten())
-                    for pro_landmarks in poses
-                ]
-                similarities[player] = max(player_similarities)
-            return similarities
-
-    def get_angle_differences(self, user_landmarks, player_name):
+            # Approximate over a large corpus: players without a pose in the
+            # probed cells are left out
+            if self.use_ann():
+                matches = self.ann.best_match_per_player(user_landmarks, self.index)
+            else:
+                matches = self.index.best_match_per_player(user_landmarks)
+            return {player: match.similarity for player, match in matches.items()}
+
+    def get_angle_differences(self, user_landmarks, player_name, match=None):
         user_landmarks = np.asarray(user_landmarks).reshape(-1, 3)
-        best_pro_pose = max(
-            self.pro_poses[player_name],
-            key=lambda x: 1 - cosine(user_landmarks.flatten(), x.flatten()),
-        )
-        best_pro_pose = np.asarray(best_pro_pose).reshape(-1, 3)
+        if match is None:
+            match = self.find_best_match(user_landmarks, player_name)
+        best_pro_pose = np.asarray(match.pose).reshape(-1, 3)
 
         angle_diffs = {}
-        key_joints = [
-            ("Elbow", 13, 11, 15),  # Right elbow
-            ("Shoulder", 11, 13, 23),  # Right shoulder
-            ("Knee", 25, 23, 27),  # Right knee
-            ("Hip", 23, 25, 11),  # Right hip
-        ]
-
-        for joint_name, p1, p2, p3 in key_joints:
+        for joint_name, p1, p2, p3 in KEY_JOINTS:
             user_angle = calculate_angle(
                 user_landmarks[p1], user_landmarks[p2], user_landmarks[p3]
             )
@@ -64,24 +131,6 @@ class PoseSimilarityCalculator:
 
         return angle_diffs
 
-    def save_pro_poses(self, filename):
-        np.save(filename, self.pro_poses)
-        print(f"Pro poses saved to {filename}")
-
-    def load_pro_poses(self, filename):
-        try:
-            self.pro_poses = np.load(filename, allow_pickle=True).item()
-            print(f"Pro poses loaded from {filename}")
-        except FileNotFoundError:
-            print(
-                f"Error: The file '{filename}' was not found in the current directory."
-            )
-            print(f"Current directory: {os.getcwd()}")
-            print(
-                "Please ensure the file exists or run the process_pro_players function first."
-            )
-            raise
-
 
 def calculate_angle(p1, p2, p3):
     v1 = p1 - p2
@@ -90,79 +139,154 @@ def calculate_angle(p1, p2, p3):
     return np.degrees(angle)
 
 
-def process_pro_players(pro_dir, output_file):
-    if os.path.exists(output_file):
-        print(f"{output_file} already exists. Loading existing poses...")
-        calculator = PoseSimilarityCalculator()
-        calculator.load_pro_poses(output_file)
-        return calculator
-
-    calculator = PoseSimilarityCalculator()
-    print(f"Processing pro players from directory: {pro_dir}")
-    for player in os.listdir(pro_dir):
-        player_dir = os.path.join(pro_dir, player)
-        if not os.path.isdir(player_dir):
-            continue
-        print(f"Processing player: {player}")
-        for image_name in os.listdir(player_dir):
-            image_path = os.path.join(player_dir, image_name)
-            print(f"Processing image: {image_path}")
-            landmarks = extract_pose_landmarks(image_path)
-            if landmarks is not None:
-                calculator.add_pro_pose(player, landmarks)
-            else:
-                print(f"No landmarks detected for image: {image_path}")
-
-    calculator.save_pro_poses(output_file)
-    return calculator
+def calculate_joint_angles(landmarks_batch):
+    # (N, 33, 3) landmarks -> (N, len(KEY_JOINTS)) angles in degrees
+    landmarks_batch = np.asarray(landmarks_batch).reshape(-1, 33, 3)
+    return calculate_angles_batch(
+        landmarks_batch[:, KEY_JOINT_POINTS[:, 0]],
+        landmarks_batch[:, KEY_JOINT_POINTS[:, 1]],
+        landmarks_batch[:, KEY_JOINT_POINTS[:, 2]],
+    )
+
+
+def process_pro_players(pro_dir, store_dir=None, rebuild=False):
+    # Loads the memory-mapped pro pose store, building it from the reference
+    # screenshots and clips on first use. rebuild=True re-processes only new
+    # or changed files.
+    store_dir = store_dir or Config.PRO_POSE_STORE_DIR
+    if store_exists(store_dir) and not rebuild:
+        store = load_pose_store(store_dir)
+        logger.info("Pro poses loaded from %s (generation %s)", store_dir, store.generation)
+    else:
+        store = build_pose_store(pro_dir, store_dir)
+    return PoseSimilarityCalculator.from_store(store)
+
+
+def find_matching_player(calculator, player_name):
+    # Make the player name check case-insensitive. Players left without any
+    # pose have nothing to compare against and count as not found.
+    player_name_lower = player_name.lower()
+    return next(
+        (
+            p
+            for p, poses in calculator.pro_poses.items()
+            if p.lower() == player_name_lower and len(poses)
+        ),
+        None,
+    )
+
+
+def player_not_found(calculator, player_name):
+    return {
+        "error": f"Player '{player_name}' not found in the database",
+        "available_players": [p for p, poses in calculator.pro_poses.items() if len(poses)],
+    }
+
+
+def build_suggestions(angle_differences):
+    suggestions = []
+    for joint, diff in angle_differences.items():
+        if abs(diff) > 10:  # Threshold for suggesting adjustments
+            direction = "increase" if diff > 0 else "decrease"
+            suggestions.append(
+                f"{direction} {joint.lower()} angle by about {abs(diff):.1f} degrees"
+            )
+    return suggestions
 
 
-def analyze_user_shot(image_path, calculator, player_name="Lebron"):
+def analyze_user_shot(image_path, calculator, player_name="Lebron", content_hash=None):
     try:
-        user_landmarks = extract_pose_landmarks(image_path)
+        # With the upload's content hash, a re-upload reuses stored landmarks
+        user_landmarks = extract_pose_landmarks_cached(image_path, content_hash)
         if user_landmarks is None:
             return {"error": "Failed to extract pose landmarks from the image"}
 
-        user_landmarks = np.asarray(user_landmarks)
+        return score_user_landmarks(user_landmarks, calculator, player_name)
 
-        # Make the player name check case-insensitive
-        player_name_lower = player_name.lower()
-        available_players = list(calculator.pro_poses.keys())
-        matching_player = next(
-            (p for p in available_players if p.lower() == player_name_lower), None
-        )
+    except Exception as e:
+        logger.exception("Error analyzing user shot")
+        return {"error": f"An error occurred while analyzing the user shot: {str(e)}"}
 
-        if not matching_player:
-            return {
-                "error": f"Player '{player_name}' not found in the database",
-                "available_players": available_players,
-            }
 
+def score_user_landmarks(user_landmarks, calculator, player_name):
+    # Scoring half of analyze_user_shot, for landmarks posed elsewhere
+    user_landmarks = np.asarray(user_landmarks)
+
+    matching_player = find_matching_player(calculator, player_name)
+    if not matching_player:
+        return player_not_found(calculator, player_name)
+
+    with stage("scoring"):
+        # One lookup serves both the score and the angle comparison
+        match = calculator.find_best_match(user_landmarks, matching_player)
         similarity_score = calculator.calculate_similarity(
-            user_landmarks, matching_player
+            user_landmarks, matching_player, match
         )
         angle_differences = calculator.get_angle_differences(
-            user_landmarks, matching_player
+            user_landmarks, matching_player, match
         )
 
-        suggestions = []
-        for joint, diff in angle_differences.items():
-            if abs(diff) > 10:  # Threshold for suggesting adjustments
-                direction = "increase" if diff > 0 else "decrease"
-                suggestions.append(
-                    f"{direction} {joint.lower()} angle by about {abs(diff):.1f} degrees"
-                )
-
-        return {
-            "player": matching_player,
-            "similarity_score": similarity_score,
-            "angle_differences": angle_differences,
-            "suggestions": suggestions,
-        }
+    return {
+        "player": matching_player,
+        "similarity_score": similarity_score,
+        "angle_differences": angle_differences,
+        "suggestions": build_suggestions(angle_differences),
+    }
+
+
+def score_landmarks_batch(landmarks_batch, calculator, player_name):
+    # Vectorized scoring of (N, 33, 3) landmarks against one player: a single
+    # matmul for the similarities and best matches, then the key joint angles
+    # of users and matched pro poses in one pass each
+    landmarks_batch = np.asarray(landmarks_batch).reshape(-1, 33, 3)
+    similarities, rows = calculator.find_best_matches(landmarks_batch, player_name)
+    pro_angles = calculate_joint_angles(calculator.index.poses[rows])
+    user_angles = calculate_joint_angles(landmarks_batch)
+    return similarities, pro_angles - user_angles
+
+
+def analyze_user_shots_batch(items, calculator, player_name="Lebron"):
+    # items is either an (N, 33, 3) landmark array or a list of images (paths
+    # or decoded frames). Items whose pose cannot be extracted get an error
+    # entry in place so results stay aligned with the input.
+    try:
+        matching_player = find_matching_player(calculator, player_name)
+        if not matching_player:
+            return player_not_found(calculator, player_name)
+
+        if isinstance(items, np.ndarray):
+            landmarks_batch = items.reshape(-1, 33, 3)
+            valid = list(range(len(landmarks_batch)))
+            count = len(landmarks_batch)
+        else:
+            extracted = [extract_pose_landmarks(item) for item in items]
+            valid = [i for i, landmarks in enumerate(extracted) if landmarks is not None]
+            landmarks_batch = np.array([extracted[i] for i in valid]).reshape(-1, 33, 3)
+            count = len(extracted)
+
+        results = [
+            {"error": "Failed to extract pose landmarks from the image"}
+            for _ in range(count)
+        ]
+
+        if valid:
+            similarities, angle_diffs = score_landmarks_batch(
+                landmarks_batch, calculator, matching_player
+            )
+            for i, similarity, diffs in zip(valid, similarities, angle_diffs):
+                angle_differences = dict(zip(KEY_JOINT_NAMES, diffs.tolist()))
+                results[i] = {
+                    "player": matching_player,
+                    "similarity_score": float(similarity),
+                    "angle_differences": angle_differences,
+                    "suggestions": build_suggestions(angle_differences),
+                }
+
+        return {"player": matching_player, "results": results}
 
     except Exception as e:
-        print(f"Error analyzing user shot: {e}")
-        return {"error": f"An error occurred while analyzing the user shot: {str(e)}"}
+        logger.exception("Error analyzing user shots")
+        return {"error": f"An error occurred while analyzing the user shots: {str(e)}"}
 
 
 def generate_user_friendly_response(result):
@@ -198,17 +322,22 @@ General Angle Adjustment Advice:
     return response
 
 
-# Initialize the calculator
-current_dir = os.path.dirname(os.path.abspath(__file__))
-pro_dir = os.path.join(current_dir, "pro_players")
-pro_poses_file = os.path.join(current_dir, "pro_poses.npy")
+def __getattr__(name):
+    # Backwards compatible "from ml.analyze_shot import calculator", resolved
+    # lazily through the registry instead of at import time
+    if name == "calculator":
+        from ml.registry import get_calculator
 
-calculator = process_pro_players(pro_dir, pro_poses_file)
+        return get_calculator()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# This line ensures that the 'calculator' object is available when imported
-__all__ = ["analyze_user_shot", "calculator"]
+
+__all__ = ["analyze_user_shot", "analyze_user_shots_batch", "calculator"]
 
 if __name__ == "__main__":
+    from ml.registry import current_dir, get_calculator
+
+    calculator = get_calculator()
     print("Current working directory:", os.getcwd())
 
     test_image_path = os.path.join(
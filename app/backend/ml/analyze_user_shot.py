@@ -10,11 +10,10 @@ from analyze_shot import analyze_user_shot, process_pro_players
 
 # Set up paths
 pro_dir = os.path.join(current_dir, "pro_players")
-pro_poses_file = os.path.join(current_dir, "pro_poses.npy")
 
 # Initialize the calculator
 try:
-    calculator = process_pro_players(pro_dir, pro_poses_file)
+    calculator = process_pro_players(pro_dir)
     print("Calculator initialized successfully.")
 except Exception as e:
     print(f"Error initializing calculator: {str(e)}")
@@ -0,0 +1,155 @@
+import os
+import threading
+
+import numpy as np
+from ml.pose_features import pose_features
+from ml.pose_index import PoseMatch, normalize_rows
+
+# Inverted-file (IVF) approximate nearest neighbour index over pose feature
+# vectors. Spherical k-means splits the corpus into nlist cells; a query only
+# scores the vectors of its nprobe closest cells. Entries are kept as (player,
+# position within that player's poses) rather than global rows, so they stay
+# valid when ProPoseIndex is rebuilt after add_pro_pose, and vectors are read
+# from the ProPoseIndex (or the memory-mapped store) instead of being copied.
+
+
+def assign_cells(vectors, centroids, batch_size=8192):
+    cells = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start : start + batch_size]
+        cells[start : start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+    return cells
+
+
+def train_centroids(vectors, nlist, iterations=10, sample_size=256, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) > nlist * sample_size:
+        vectors = vectors[rng.choice(len(vectors), nlist * sample_size, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        cells = assign_cells(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, cells, vectors)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty cells from random vectors rather than losing them
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids, nprobe=8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nprobe = nprobe
+        self.generation = None
+        self.players = []
+        self._player_ids = {}
+        self._entry_player = []
+        self._entry_position = []
+        self._cells = [[] for _ in range(len(self.centroids))]
+        self._lock = threading.Lock()
+        self._arrays = None
+
+    @classmethod
+    def build(cls, pose_index, nlist=None, nprobe=8, iterations=10):
+        count = len(pose_index)
+        if not nlist:
+            nlist = int(4 * np.sqrt(count))
+        nlist = max(1, min(nlist, count))
+        ann = cls(train_centroids(pose_index.vectors, nlist, iterations), nprobe)
+        for player in pose_index.players:
+            rows = pose_index.player_rows(player)
+            ann.add(player, range(rows.stop - rows.start), pose_index.vectors[rows])
+        return ann
+
+    def __len__(self):
+        return len(self._entry_player)
+
+    def add(self, player, positions, vectors):
+        vectors = normalize_rows(np.asarray(vectors).reshape(len(positions), -1))
+        cells = assign_cells(vectors, self.centroids)
+        with self._lock:
+            player_id = self._player_ids.get(player)
+            if player_id is None:
+                player_id = self._player_ids[player] = len(self.players)
+                self.players.append(player)
+            for position, cell in zip(positions, cells):
+                self._cells[cell].append(len(self._entry_player))
+                self._entry_player.append(player_id)
+                self._entry_position.append(position)
+            self._arrays = None
+
+    def _frozen(self):
+        with self._lock:
+            if self._arrays is None:
+                self._arrays = (
+                    [np.array(cell, dtype=np.int64) for cell in self._cells],
+                    np.array(self._entry_player, dtype=np.int64),
+                    np.array(self._entry_position, dtype=np.int64),
+                    list(self.players),
+                )
+            return self._arrays
+
+    def search(self, query, pose_index, nprobe=None):
+        # Returns (rows, scores) of the candidate vectors in the probed cells
+        cells, entry_player, entry_position, players = self._frozen()
+        query = pose_features(query)[0]
+        nprobe = min(nprobe or self.nprobe, len(cells))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        entries = np.concatenate([cells[cell] for cell in probe])
+
+        starts = np.array(
+            [pose_index.player_rows(p).start if p in pose_index else -1 for p in players],
+            dtype=np.int64,
+        )
+        entry_starts = starts[entry_player[entries]]
+        entries = entries[entry_starts >= 0]
+        rows = entry_starts[entry_starts >= 0] + entry_position[entries]
+        return rows, pose_index.vectors[rows] @ query
+
+    def best_match_per_player(self, query, pose_index, nprobe=None):
+        # Like ProPoseIndex.best_match_per_player, but only players with a
+        # pose in the probed cells are returned
+        rows, scores = self.search(query, pose_index, nprobe)
+        order = np.argsort(-scores)
+        row_players = np.searchsorted(pose_index.offsets, rows[order], side="right") - 1
+        _, first = np.unique(row_players, return_index=True)
+        matches = {}
+        for k in first:
+            row = int(rows[order[k]])
+            player = pose_index.players[row_players[k]]
+            matches[player] = PoseMatch(player, float(scores[order[k]]), row, pose_index.poses[row])
+        return matches
+
+    def save(self, path):
+        cells, entry_player, entry_position, players = self._frozen()
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            cell_offsets=np.cumsum([0] + [len(cell) for cell in cells]),
+            cell_entries=np.concatenate(cells) if cells else np.empty(0, np.int64),
+            entry_player=entry_player,
+            entry_position=entry_position,
+            players=np.array(players, dtype=str),
+            generation=np.array(self.generation or ""),
+            nprobe=np.array(self.nprobe),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            ann = cls(data["centroids"], int(data["nprobe"]))
+            offsets = data["cell_offsets"]
+            entries = data["cell_entries"]
+            ann._cells = [
+                entries[offsets[i] : offsets[i + 1]].tolist() for i in range(len(offsets) - 1)
+            ]
+            ann._entry_player = data["entry_player"].tolist()
+            ann._entry_position = data["entry_position"].tolist()
+            ann.players = data["players"].tolist()
+            ann._player_ids = {player: i for i, player in enumerate(ann.players)}
+            ann.generation = str(data["generation"]) or None
+        return ann
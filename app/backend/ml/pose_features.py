@@ -0,0 +1,74 @@
+import numpy as np
+
+# Framing-invariant pose features used for matching. Raw MediaPipe landmarks
+# are normalized image coordinates, so the same shot filmed from further back
+# or off-center gives a different vector. Each pose is centered on the hip
+# midpoint and scaled by torso length, reduced to the joints that matter for
+# a jump shot, and extended with the joint angles. The pro library is
+# featurized once when the index is built; only the user pose is per query.
+FEATURE_VERSION = 1
+
+LEFT_SHOULDER, RIGHT_SHOULDER = 11, 12
+LEFT_HIP, RIGHT_HIP = 23, 24
+
+# Shoulders, elbows, wrists, hips, knees, ankles
+FEATURE_JOINTS = np.array([11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28])
+
+# Point triples with the angle measured at the middle point, both sides
+FEATURE_ANGLES = np.array(
+    [
+        (11, 13, 15),  # Left elbow
+        (12, 14, 16),  # Right elbow
+        (13, 11, 23),  # Left shoulder
+        (14, 12, 24),  # Right shoulder
+        (11, 23, 25),  # Left hip
+        (12, 24, 26),  # Right hip
+        (23, 25, 27),  # Left knee
+        (24, 26, 28),  # Right knee
+    ]
+)
+
+# Angles are scaled to [0, 1] and weighted against the coordinates, which
+# span a few torso lengths
+ANGLE_WEIGHT = 1.0
+
+FEATURE_SIZE = len(FEATURE_JOINTS) * 3 + len(FEATURE_ANGLES)
+
+
+def calculate_angles_batch(p1, p2, p3):
+    # Angle at p2 in degrees, for (..., 3) arrays of points
+    v1 = p1 - p2
+    v2 = p3 - p2
+    cos_angle = np.sum(v1 * v2, axis=-1)
+    cos_angle /= np.linalg.norm(v1, axis=-1) * np.linalg.norm(v2, axis=-1)
+    return np.degrees(np.arccos(np.clip(cos_angle, -1.0, 1.0)))
+
+
+def normalize_pose(landmarks_batch):
+    # (N, 33, 3) -> same shape, hip midpoint at the origin and a torso
+    # (hip midpoint to shoulder midpoint, in the image plane) of length 1
+    landmarks_batch = np.asarray(landmarks_batch, dtype=np.float32).reshape(-1, 33, 3)
+    hips = (landmarks_batch[:, LEFT_HIP] + landmarks_batch[:, RIGHT_HIP]) / 2
+    shoulders = (landmarks_batch[:, LEFT_SHOULDER] + landmarks_batch[:, RIGHT_SHOULDER]) / 2
+    torso = np.linalg.norm((shoulders - hips)[:, :2], axis=-1)
+    torso[torso == 0] = 1.0
+    return (landmarks_batch - hips[:, np.newaxis]) / torso[:, np.newaxis, np.newaxis]
+
+
+def pose_features(landmarks_batch):
+    # (N, 33, 3) landmarks -> (N, FEATURE_SIZE) float32 unit vectors
+    normalized = normalize_pose(landmarks_batch)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        angles = calculate_angles_batch(
+            normalized[:, FEATURE_ANGLES[:, 0]],
+            normalized[:, FEATURE_ANGLES[:, 1]],
+            normalized[:, FEATURE_ANGLES[:, 2]],
+        )
+    # Collapsed joints (all three points equal) have no angle
+    angles = np.nan_to_num(angles) / 180.0 * ANGLE_WEIGHT
+    features = np.concatenate(
+        [normalized[:, FEATURE_JOINTS].reshape(len(normalized), len(FEATURE_JOINTS) * 3), angles], axis=1
+    ).astype(np.float32)
+    norms = np.linalg.norm(features, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return features / norms
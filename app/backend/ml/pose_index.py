@@ -0,0 +1,86 @@
+from collections import namedtuple
+
+import numpy as np
+from ml.pose_features import pose_features
+
+PoseMatch = namedtuple("PoseMatch", ["player", "similarity", "row", "pose"])
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Every pro pose stacked into one contiguous matrix of unit feature vectors
+# (see pose_features.py), with an offset table giving each player's block of
+# rows. Cosine similarity against the whole library is then a single
+# matrix-vector product, and only the query pose is featurized per call.
+class ProPoseIndex:
+    def __init__(self, players, offsets, vectors, poses):
+        self.players = list(players)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.poses = poses
+        self._slices = {
+            player: slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+            for i, player in enumerate(self.players)
+        }
+
+    @classmethod
+    def from_poses(cls, pro_poses):
+        players = [player for player, poses in pro_poses.items() if len(poses)]
+        offsets = [0]
+        stacked = []
+        for player in players:
+            stacked.extend(np.asarray(pose).reshape(-1, 3) for pose in pro_poses[player])
+            offsets.append(len(stacked))
+        if stacked:
+            poses = np.stack(stacked)
+        else:
+            poses = np.empty((0, 33, 3))
+        return cls(players, offsets, pose_features(poses), poses)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def __contains__(self, player):
+        return player in self._slices
+
+    def player_rows(self, player):
+        return self._slices[player]
+
+    def similarities(self, user_landmarks, player=None):
+        query = pose_features(user_landmarks)[0]
+        vectors = self.vectors if player is None else self.vectors[self._slices[player]]
+        return vectors @ query
+
+    def best_match(self, user_landmarks, player):
+        rows = self._slices[player]
+        scores = self.similarities(user_landmarks, player)
+        best = int(np.argmax(scores))
+        row = rows.start + best
+        return PoseMatch(player, float(scores[best]), row, self.poses[row])
+
+    def best_matches(self, user_landmarks_batch, player):
+        # (N, 33, 3) queries against one player's block in a single matmul
+        rows = self._slices[player]
+        queries = pose_features(user_landmarks_batch)
+        scores = queries @ self.vectors[rows].T
+        best = np.argmax(scores, axis=1)
+        similarities = scores[np.arange(len(best)), best]
+        return similarities, rows.start + best
+
+    def best_match_per_player(self, user_landmarks):
+        if not self.players:
+            return {}
+        scores = self.similarities(user_landmarks)
+        starts = self.offsets[:-1]
+        best_scores = np.maximum.reduceat(scores, starts)
+        matches = {}
+        for i, player in enumerate(self.players):
+            rows = self._slices[player]
+            row = rows.start + int(np.argmax(scores[rows]))
+            matches[player] = PoseMatch(player, float(best_scores[i]), row, self.poses[row])
+        return matches
@@ -0,0 +1,356 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ml.pose_features import FEATURE_VERSION, pose_features
+from ml.pose_index import ProPoseIndex
+
+logger = logging.getLogger(__name__)
+
+# On-disk layout of the pro pose library, no pickles involved:
+#   manifest.json        format version, generation, player offset table and
+#                        one record per reference image or clip (mtime, size,
+#                        sha256, first row in the arrays or null when no pose
+#                        was found, and the number of rows)
+#   poses-<gen>.npy      float32 (N, 33, 3), players in contiguous row blocks
+#   vectors-<gen>.npy    float32 (N, FEATURE_SIZE) pose features used by
+#                        ProPoseIndex, tagged with feature_version
+# The arrays are memory-mapped read-only, so every worker process on the box
+# shares one copy through the page cache. A new generation is published by
+# writing its arrays first and then atomically replacing manifest.json. A
+# loaded store holds a shared lock on its poses file until it is garbage
+# collected, and builds only remove generations nobody holds a lock on.
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+CLIP_EXTENSIONS = {".mp4", ".mov", ".avi"}
+LOCK_NAME = ".build.lock"
+
+
+class ProPoseStore:
+    def __init__(self, directory, manifest, poses, vectors, lease=None):
+        self.directory = directory
+        self.manifest = manifest
+        self.poses = poses
+        self.vectors = vectors
+        # Open poses file holding the shared lock, see load_pose_store
+        self.lease = lease
+
+    @property
+    def generation(self):
+        return self.manifest["generation"]
+
+    @property
+    def players(self):
+        return [entry["name"] for entry in self.manifest["players"]]
+
+    @property
+    def offsets(self):
+        offsets = [0]
+        for entry in self.manifest["players"]:
+            offsets.append(entry["offset"] + entry["count"])
+        return offsets
+
+    def player_poses(self, player):
+        for entry in self.manifest["players"]:
+            if entry["name"] == player:
+                return self.poses[entry["offset"] : entry["offset"] + entry["count"]]
+        raise KeyError(player)
+
+    def to_index(self):
+        return ProPoseIndex(self.players, self.offsets, self.vectors, self.poses)
+
+
+def store_exists(directory):
+    return os.path.exists(os.path.join(directory, MANIFEST_NAME))
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported pro pose store format {manifest.get('format_version')} in {directory}"
+        )
+    return manifest
+
+
+def _lease_generation(directory):
+    # -> (manifest, open poses file with a shared lock). A build may replace
+    # the manifest and remove the generation it named in between, in which
+    # case the new manifest is read.
+    generation = None
+    while True:
+        manifest = read_manifest(directory)
+        if manifest["generation"] == generation:
+            raise FileNotFoundError(
+                f"Pro pose store generation {generation} in {directory} is missing"
+            )
+        generation = manifest["generation"]
+        try:
+            lease = open(os.path.join(directory, manifest["poses_file"]), "rb")
+        except FileNotFoundError:
+            continue
+        fcntl.flock(lease, fcntl.LOCK_SH)
+        # Unlinked while waiting for the lock
+        if os.fstat(lease.fileno()).st_nlink:
+            return manifest, lease
+        lease.close()
+
+
+def load_pose_store(directory, mmap=True):
+    manifest, lease = _lease_generation(directory)
+    mmap_mode = "r" if mmap else None
+    poses = np.load(os.path.join(directory, manifest["poses_file"]), mmap_mode=mmap_mode)
+    if manifest.get("feature_version") == FEATURE_VERSION:
+        vectors = np.load(os.path.join(directory, manifest["vectors_file"]), mmap_mode=mmap_mode)
+    else:
+        # Written with an older feature pipeline; the poses are still good
+        logger.warning(
+            "Pose features in %s are outdated, recomputing (rebuild to persist)", directory
+        )
+        vectors = pose_features(poses)
+    return ProPoseStore(directory, manifest, poses, vectors, lease)
+
+
+def write_pose_store(directory, player_poses, images=None):
+    # player_poses: {player: [(33, 3) landmarks, ...]} in the order rows are
+    # written; images: per-image records whose "row" indexes the new arrays
+    os.makedirs(directory, exist_ok=True)
+    # Nanosecond timestamps sort by age and never reuse the name of a file
+    # that a running worker may still have mapped
+    generation = str(time.time_ns())
+
+    players = []
+    stacked = []
+    for player, poses in player_poses.items():
+        if not len(poses):
+            continue
+        players.append({"name": player, "offset": len(stacked), "count": len(poses)})
+        stacked.extend(np.asarray(pose, dtype=np.float32).reshape(33, 3) for pose in poses)
+
+    poses = np.stack(stacked) if stacked else np.empty((0, 33, 3), dtype=np.float32)
+    vectors = pose_features(poses)
+
+    poses_file = f"poses-{generation}.npy"
+    vectors_file = f"vectors-{generation}.npy"
+    np.save(os.path.join(directory, poses_file), np.ascontiguousarray(poses))
+    np.save(os.path.join(directory, vectors_file), np.ascontiguousarray(vectors))
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "generation": generation,
+        "feature_version": FEATURE_VERSION,
+        "created_at": time.time(),
+        "count": len(poses),
+        "poses_file": poses_file,
+        "vectors_file": vectors_file,
+        "players": players,
+        "images": images or [],
+    }
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    _remove_stale_generations(directory, generation)
+    return load_pose_store(directory)
+
+
+def _remove_stale_generations(directory, current):
+    # Generations still loaded somewhere, by workers that have not reloaded
+    # yet or requests finishing on an old calculator, are kept; the next
+    # build removes them once their shared locks are gone
+    generations = set()
+    for name in os.listdir(directory):
+        if name.endswith(".npy") and "-" in name:
+            generations.add(name.split("-", 1)[1][: -len(".npy")])
+    generations.discard(current)
+    for generation in generations:
+        poses_path = os.path.join(directory, f"poses-{generation}.npy")
+        try:
+            f = open(poses_path, "rb")
+        except FileNotFoundError:
+            f = None
+        try:
+            if f is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+            for prefix in ("poses", "vectors"):
+                try:
+                    os.remove(os.path.join(directory, f"{prefix}-{generation}.npy"))
+                except OSError:
+                    pass
+        finally:
+            if f is not None:
+                f.close()
+
+
+def hash_image(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_reference_files(pro_dir):
+    for player in sorted(os.listdir(pro_dir)):
+        player_dir = os.path.join(pro_dir, player)
+        if not os.path.isdir(player_dir):
+            continue
+        for file_name in sorted(os.listdir(player_dir)):
+            if os.path.splitext(file_name)[1].lower() in IMAGE_EXTENSIONS | CLIP_EXTENSIONS:
+                yield player, file_name, os.path.join(player_dir, file_name)
+
+
+def extract_clip_poses(clip_path):
+    # Every pose found in a reference clip, sampled at PRO_CLIP_FPS
+    from config import Config
+    from ml.video_analysis import extract_video_landmarks
+
+    frame_landmarks = extract_video_landmarks(clip_path, target_fps=Config.PRO_CLIP_FPS)
+    return [landmarks for _, landmarks in frame_landmarks]
+
+
+@contextmanager
+def store_lock(directory):
+    # Exclusive lock on the store directory, so builds started by several
+    # worker processes run one after another instead of racing
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_NAME), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_pose_store(pro_dir, directory, extract=None, extract_clip=None):
+    # Incremental rebuild: a file keeps its stored poses when its mtime and
+    # size, or failing that its content hash, match the current manifest.
+    # Only new or changed images and clips go through pose extraction.
+    with store_lock(directory):
+        return _build_pose_store(pro_dir, directory, extract, extract_clip or extract_clip_poses)
+
+
+def _build_pose_store(pro_dir, directory, extract, extract_clip):
+    if extract is None:
+        from media_processing.image_processor import extract_pose_landmarks as extract
+
+    previous = load_pose_store(directory) if store_exists(directory) else None
+    known = {}
+    by_hash = {}
+    if previous is not None:
+        for record in previous.manifest["images"]:
+            known[(record["player"], record["file"])] = record
+            by_hash.setdefault(record["sha256"], record)
+
+    player_poses = {}
+    images = []
+    processed = 0
+    logger.info("Processing pro players from directory: %s", pro_dir)
+    for player, file_name, file_path in list_reference_files(pro_dir):
+        stat = os.stat(file_path)
+        record = known.get((player, file_name))
+        if record is not None and (record["mtime"], record["size"]) == (stat.st_mtime, stat.st_size):
+            sha256 = record["sha256"]
+        else:
+            sha256 = hash_image(file_path)
+            record = by_hash.get(sha256)
+
+        if record is not None:
+            row = record["row"]
+            # Records written before clips were supported have no count
+            count = record.get("count", 0 if row is None else 1)
+            file_poses = list(previous.poses[row : row + count]) if row is not None else []
+        elif os.path.splitext(file_name)[1].lower() in CLIP_EXTENSIONS:
+            logger.info("Processing clip: %s", file_path)
+            file_poses = extract_clip(file_path)
+            processed += 1
+            if not file_poses:
+                logger.warning("No landmarks detected in clip: %s", file_path)
+        else:
+            logger.info("Processing image: %s", file_path)
+            pose = extract(file_path)
+            file_poses = [pose] if pose is not None else []
+            processed += 1
+            if pose is None:
+                logger.warning("No landmarks detected for image: %s", file_path)
+
+        row = None
+        if file_poses:
+            poses = player_poses.setdefault(player, [])
+            # Row numbers are per player here and shifted to global rows below
+            row = len(poses)
+            poses.extend(np.array(pose, dtype=np.float32) for pose in file_poses)
+        images.append(
+            {
+                "player": player,
+                "file": file_name,
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "sha256": sha256,
+                "row": row,
+                "count": len(file_poses),
+            }
+        )
+
+    offsets = {}
+    offset = 0
+    for player, poses in player_poses.items():
+        offsets[player] = offset
+        offset += len(poses)
+    for record in images:
+        if record["row"] is not None:
+            record["row"] += offsets[record["player"]]
+
+    if previous is not None and processed == 0 and images == previous.manifest["images"]:
+        logger.info("Pro pose store is up to date")
+        return previous
+
+    logger.info("Writing pro pose store to %s (%d file(s) processed)", directory, processed)
+    return write_pose_store(directory, player_poses, images)
+
+
+def import_legacy_poses(legacy_file, directory):
+    # One-off migration from a pickled {player: [landmarks]} .npy file of an
+    # old deployment, run by hand (python ml/pose_store.py --import-legacy);
+    # it unpickles, so only use it on files you created. The legacy file has
+    # no per-image records, so the next incremental build re-processes the
+    # reference images once.
+    legacy = np.load(legacy_file, allow_pickle=True).item()
+    logger.info("Migrating legacy pro poses from %s to %s", legacy_file, directory)
+    return write_pose_store(directory, legacy)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from config import Config
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the pro pose store")
+    parser.add_argument(
+        "--import-legacy",
+        metavar="FILE",
+        help="migrate a pickled pro_poses.npy instead of building from pro_players",
+    )
+    args = parser.parse_args()
+
+    if args.import_legacy:
+        import_legacy_poses(args.import_legacy, Config.PRO_POSE_STORE_DIR)
+    else:
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        build_pose_store(os.path.join(current_dir, "pro_players"), Config.PRO_POSE_STORE_DIR)
@@ -0,0 +1,195 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Keeps the pro library current while the server runs. New or changed
+# reference images and clips, whether saved through the admin endpoint or
+# copied into pro_players/<name>/, are picked up by a background thread. It
+# runs the incremental store build, so only the changed files go through pose
+# extraction, and publishes the new calculator in this process. Other worker
+# processes see the new store generation through the registry's reload check.
+# Only one process on the box polls the directory, the one holding the
+# watcher lock; builds from several processes are serialized by a lock on
+# the store.
+WATCHER_LOCK_NAME = ".watcher.lock"
+
+
+def snapshot_reference_files(pro_dir):
+    from ml.pose_store import list_reference_files
+
+    if not os.path.isdir(pro_dir):
+        return {}
+    snapshot = {}
+    for player, file_name, path in list_reference_files(pro_dir):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        snapshot[(player, file_name)] = (stat.st_mtime, stat.st_size)
+    return snapshot
+
+
+def valid_player_name(name):
+    # Used as a directory name under pro_players
+    return (
+        bool(name)
+        and len(name) <= 100
+        and not name.startswith(".")
+        and "/" not in name
+        and "\\" not in name
+        and name.isprintable()
+    )
+
+
+class LibraryUpdater:
+    def __init__(self, pro_dir, watch_interval=None, lock_dir=None):
+        self.pro_dir = pro_dir
+        self.watch_interval = (
+            Config.PRO_WATCH_INTERVAL if watch_interval is None else watch_interval
+        )
+        self.lock_path = os.path.join(lock_dir or Config.PRO_POSE_STORE_DIR, WATCHER_LOCK_NAME)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+        self._watching = False
+        self._leader = None
+        self._status = {
+            "state": "idle",
+            "requested_at": None,
+            "finished_at": None,
+            "generation": None,
+            "error": None,
+        }
+
+    def start(self, watch=False):
+        # Threads do not survive a fork, so a forked worker starts its own.
+        # With watch=True the thread also polls pro_dir whenever this process
+        # holds the watcher lock; otherwise it only runs requested updates.
+        with self._lock:
+            self._watching = self._watching or watch
+            if self._thread is not None and self._pid == os.getpid():
+                return self
+            self._pid = os.getpid()
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def request_update(self):
+        with self._lock:
+            self._status.update(state="pending", requested_at=time.time())
+        self.start()
+        self._wake.set()
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    def _lead(self):
+        # The lock is released when its holder exits, and a watching worker
+        # that is still running takes over on its next poll
+        if self._leader is None:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            f = open(self.lock_path, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+            self._leader = f
+            logger.info("Watching %s for pro library changes", self.pro_dir)
+        return True
+
+    def _run(self):
+        # The watcher only rebuilds once a changed directory has stayed the
+        # same for a whole interval, so a copy in progress is not ingested
+        # half-way
+        built = seen = None
+        while not self._stopped:
+            if built is None and self._watching and self._lead():
+                # Earlier changes went into the startup build or were handled
+                # by the previous watcher
+                built = seen = snapshot_reference_files(self.pro_dir)
+            polling = self._watching and self.watch_interval > 0
+            requested = self._wake.wait(self.watch_interval if polling else None)
+            self._wake.clear()
+            if self._stopped:
+                break
+            if built is None:
+                if requested:
+                    self._update()
+                continue
+            current = snapshot_reference_files(self.pro_dir)
+            settled = current == seen
+            seen = current
+            if requested or (settled and current != built):
+                self._update()
+                built = current
+
+    def _update(self):
+        from ml.registry import reload_calculator
+
+        with self._lock:
+            self._status.update(state="updating", error=None)
+        try:
+            calculator = reload_calculator(rebuild=True)
+        except Exception as e:
+            logger.exception("Updating the pro library failed")
+            with self._lock:
+                self._status.update(state="failed", error=str(e), finished_at=time.time())
+            return
+        with self._lock:
+            self._status.update(
+                state="idle", generation=calculator.generation, finished_at=time.time()
+            )
+
+    def save_file(self, player, file_name, stream):
+        # Written under a hidden name and renamed, so neither the watcher nor
+        # a build in progress ever reads a partial file
+        player_dir = os.path.join(self.pro_dir, player)
+        os.makedirs(player_dir, exist_ok=True)
+        path = os.path.join(player_dir, file_name)
+        tmp_path = os.path.join(player_dir, f".{file_name}.{os.getpid()}.part")
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+        return path
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        if self._leader is not None:
+            self._leader.close()
+            self._leader = None
+
+
+_library_updater = None
+_library_updater_lock = threading.Lock()
+
+
+def get_library_updater():
+    global _library_updater
+    if _library_updater is None:
+        with _library_updater_lock:
+            if _library_updater is None:
+                from ml.registry import pro_dir
+
+                _library_updater = LibraryUpdater(pro_dir)
+    return _library_updater
+
+
+def start_library_watcher():
+    # Called per worker after forking, where one worker at a time ends up
+    # polling; a no-op with PRO_WATCH_INTERVAL=0, where only the admin
+    # endpoint triggers updates
+    if Config.PRO_WATCH_INTERVAL > 0:
+        get_library_updater().start(watch=True)
@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+import time
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+pro_dir = os.path.join(current_dir, "pro_players")
+
+# The calculator handed out here is a read-only snapshot of the pro library:
+# requests keep using the one they were given, and a reload builds a complete
+# new calculator (index and ANN included) before swapping the reference, so
+# threads never see a half-updated library.
+_calculator = None
+_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_checked_at = 0.0
+_reloading = False
+
+
+def _build_calculator(rebuild=False):
+    from ml.analyze_shot import process_pro_players
+
+    calculator = process_pro_players(pro_dir, Config.PRO_POSE_STORE_DIR, rebuild=rebuild)
+    _enable_ann(calculator)
+    # Build the index now, not lazily on the first query of a shared snapshot
+    calculator.index
+    return calculator
+
+
+def _enable_ann(calculator):
+    # Below ANN_MIN_POSES queries use exact search anyway, so nothing is
+    # trained. Workers loading the same generation take turns on the store
+    # lock: the first one trains and saves the index, the others load it.
+    if not Config.ANN_ENABLED or len(calculator.index) < Config.ANN_MIN_POSES:
+        return
+    from ml.pose_store import store_lock
+
+    with store_lock(Config.PRO_POSE_STORE_DIR):
+        calculator.enable_ann(Config.PRO_ANN_INDEX_FILE)
+
+
+def get_calculator():
+    # Built on first use instead of at import time. With gunicorn's
+    # preload_app the master calls preload() once and forked workers inherit
+    # the ready calculator and its memory-mapped store.
+    global _calculator
+    if _calculator is None:
+        with _lock:
+            if _calculator is None:
+                _calculator = _build_calculator()
+    if Config.PRO_RELOAD_INTERVAL > 0:
+        _check_for_new_generation()
+    return _calculator
+
+
+def set_calculator(calculator):
+    global _calculator
+    with _lock:
+        _calculator = calculator
+
+
+def reload_calculator(rebuild=False):
+    # Loads the current store generation (rebuild=True first processes new or
+    # changed reference images) and publishes it; requests already holding
+    # the previous calculator finish with it
+    with _reload_lock:
+        calculator = _build_calculator(rebuild)
+        set_calculator(calculator)
+    logger.info("Pro library generation %s published", calculator.generation)
+    return calculator
+
+
+def _check_for_new_generation():
+    # At most every PRO_RELOAD_INTERVAL seconds, compare the store manifest
+    # with the generation being served and reload in the background when it
+    # moved on, so no request waits for the new library to load
+    global _checked_at, _reloading
+    now = time.monotonic()
+    if now - _checked_at < Config.PRO_RELOAD_INTERVAL:
+        return
+    with _lock:
+        if _reloading or now - _checked_at < Config.PRO_RELOAD_INTERVAL:
+            return
+        _checked_at = now
+        from ml.pose_store import read_manifest
+
+        try:
+            generation = read_manifest(Config.PRO_POSE_STORE_DIR)["generation"]
+        except (OSError, ValueError, KeyError):
+            return
+        if _calculator is None or generation == _calculator.generation:
+            return
+        _reloading = True
+    threading.Thread(target=_reload_in_background, daemon=True).start()
+
+
+def _reload_in_background():
+    global _reloading
+    try:
+        reload_calculator()
+    except Exception:
+        # Tried again on the next check
+        logger.exception("Reloading the pro library failed")
+    finally:
+        _reloading = False
+
+
+def preload():
+    # The index and ANN are built with the calculator, so workers never build
+    # them on demand
+    return get_calculator()
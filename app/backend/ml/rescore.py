@@ -0,0 +1,231 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import Config
+from ml.analyze_shot import KEY_JOINT_NAMES
+
+# Offline re-scoring of stored uploads, e.g. after the pro library or the
+# scoring logic changed. Shots are scored in a process pool by the same code
+# the upload route uses (analyze_user_shot / process_video with the registry's
+# PoseSimilarityCalculator), so offline and online scores match. Landmarks come
+# from the landmark cache when the bytes were seen before.
+#
+# Every finished shot is appended to <output>/progress.jsonl, so an
+# interrupted run picks up where it stopped. When all shots are done the
+# results are written column-wise to scores.npz and scores.csv.
+#
+#   python ml/rescore.py --input uploads/ --player Lebron --output rescore/
+#   python ml/rescore.py --manifest shots.csv --output rescore/
+#
+# A manifest is a CSV with a path column and optional shot_id and player
+# columns; relative paths are resolved against the manifest's directory.
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif"}
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".avi"}
+PROGRESS_NAME = "progress.jsonl"
+RUN_NAME = "run.json"
+
+
+def list_directory(directory, player):
+    shots = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS | VIDEO_EXTENSIONS:
+                path = os.path.join(root, name)
+                shot_id = os.path.relpath(path, directory)
+                shots.append({"shot_id": shot_id, "path": path, "player": player})
+    return sorted(shots, key=lambda shot: shot["shot_id"])
+
+
+def read_manifest(manifest_path, player):
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    shots = []
+    with open(manifest_path, newline="") as f:
+        for row in csv.DictReader(f):
+            path = os.path.join(base_dir, row["path"])
+            shots.append(
+                {
+                    "shot_id": row.get("shot_id") or row["path"],
+                    "path": path,
+                    "player": row.get("player") or player,
+                }
+            )
+    return shots
+
+
+def rescore_shot(shot, use_cache=True):
+    # Runs in a pool process; returns one flat record
+    from media_processing.landmark_cache import hash_file
+    from ml.analyze_shot import analyze_user_shot
+    from ml.registry import get_calculator
+    from ml.video_analysis import process_video
+
+    record = {"shot_id": shot["shot_id"], "path": shot["path"], "player": shot["player"]}
+    is_video = os.path.splitext(shot["path"])[1].lower() in VIDEO_EXTENSIONS
+    record["kind"] = "video" if is_video else "image"
+    try:
+        content_hash = hash_file(shot["path"]) if use_cache else None
+        calculator = get_calculator()
+        if is_video:
+            result = process_video(
+                shot["path"], calculator, shot["player"], content_hash=content_hash, detail="summary"
+            )
+        else:
+            result = analyze_user_shot(
+                shot["path"], calculator, shot["player"], content_hash=content_hash
+            )
+    except Exception as e:
+        result = {"error": str(e)}
+
+    if "error" in result:
+        record.update(status="error", error=result["error"])
+        return record
+    record["status"] = "ok"
+    if is_video:
+        record["matched_player"] = result["player"]
+        record["similarity_score"] = result["average_similarity_score"]
+        record["frames"] = result["frame_count"]
+        for joint in KEY_JOINT_NAMES:
+            record[joint] = result["joints"][joint]["mean"]
+    else:
+        record["matched_player"] = result["player"]
+        record["similarity_score"] = result["similarity_score"]
+        record["frames"] = 1
+        for joint in KEY_JOINT_NAMES:
+            record[joint] = result["angle_differences"][joint]
+    return record
+
+
+def load_progress(output_dir):
+    done = {}
+    path = os.path.join(output_dir, PROGRESS_NAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by the interruption; that shot reruns
+                    continue
+                done[record["shot_id"]] = record
+    return done
+
+
+def check_run(output_dir, generation, restart):
+    # A checkpoint is only resumed against the same pro library generation,
+    # otherwise the results would mix two libraries
+    run_path = os.path.join(output_dir, RUN_NAME)
+    progress_path = os.path.join(output_dir, PROGRESS_NAME)
+    if os.path.exists(run_path) and not restart:
+        with open(run_path) as f:
+            previous = json.load(f).get("generation")
+        if previous != generation:
+            raise SystemExit(
+                f"{output_dir} holds a run against pro library generation {previous}, "
+                f"the current one is {generation}; pass --restart to start over"
+            )
+    elif restart and os.path.exists(progress_path):
+        os.remove(progress_path)
+    with open(run_path, "w") as f:
+        json.dump({"generation": generation}, f)
+
+
+def write_results(output_dir, shots, done):
+    records = [done[shot["shot_id"]] for shot in shots if shot["shot_id"] in done]
+    columns = ["shot_id", "path", "player", "kind", "status", "matched_player", "similarity_score"]
+    columns += KEY_JOINT_NAMES + ["frames", "error"]
+
+    with open(os.path.join(output_dir, "scores.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(records)
+
+    numeric = ["similarity_score"] + KEY_JOINT_NAMES
+    arrays = {
+        column: np.array([record.get(column, np.nan) for record in records], dtype=np.float32)
+        for column in numeric
+    }
+    arrays["frames"] = np.array([record.get("frames", 0) for record in records], dtype=np.int32)
+    for column in ("shot_id", "player", "kind", "status", "matched_player"):
+        arrays[column] = np.array([record.get(column) or "" for record in records], dtype=str)
+    np.savez(os.path.join(output_dir, "scores.npz"), **arrays)
+    return records
+
+
+def rescore(shots, output_dir, workers=None, use_cache=True, restart=False):
+    from jobs.job_queue import _init_worker
+    from ml.registry import get_calculator
+
+    os.makedirs(output_dir, exist_ok=True)
+    check_run(output_dir, get_calculator().generation, restart)
+    done = load_progress(output_dir)
+    pending = [shot for shot in shots if shot["shot_id"] not in done]
+    print(f"{len(shots)} shot(s), {len(done)} already scored, {len(pending)} to go")
+
+    workers = workers or os.cpu_count() or 1
+    progress_path = os.path.join(output_dir, PROGRESS_NAME)
+    if os.path.exists(progress_path) and os.path.getsize(progress_path):
+        with open(progress_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            # Terminate a line cut short by the interruption
+            truncated = f.read(1) != b"\n"
+        if truncated:
+            with open(progress_path, "a") as f:
+                f.write("\n")
+    with open(progress_path, "a") as progress, ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(Config.JOB_START_METHOD),
+        initializer=_init_worker,
+    ) as executor:
+        # Only a few shots per worker in flight, so huge backlogs are streamed
+        # rather than submitted all at once
+        remaining = iter(pending)
+        in_flight = set()
+        finished = 0
+        while True:
+            while len(in_flight) < workers * 4:
+                shot = next(remaining, None)
+                if shot is None:
+                    break
+                in_flight.add(executor.submit(rescore_shot, shot, use_cache))
+            if not in_flight:
+                break
+            completed, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in completed:
+                record = future.result()
+                done[record["shot_id"]] = record
+                progress.write(json.dumps(record) + "\n")
+                finished += 1
+            progress.flush()
+            print(f"Scored {finished}/{len(pending)}")
+
+    return write_results(output_dir, shots, done)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score stored shots against the pro library")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="directory of stored uploads")
+    source.add_argument("--manifest", help="CSV with path and optional shot_id, player columns")
+    parser.add_argument("--player", default="Lebron", help="player for shots without one")
+    parser.add_argument("--output", required=True, help="directory for checkpoint and results")
+    parser.add_argument("--workers", type=int, help="pool processes (default: CPU count)")
+    parser.add_argument("--no-cache", action="store_true", help="re-extract all landmarks")
+    parser.add_argument("--restart", action="store_true", help="discard an earlier checkpoint")
+    args = parser.parse_args()
+
+    if args.input:
+        shots = list_directory(args.input, args.player)
+    else:
+        shots = read_manifest(args.manifest, args.player)
+    records = rescore(shots, args.output, args.workers, not args.no_cache, args.restart)
+    failed = sum(record["status"] != "ok" for record in records)
+    print(f"Wrote {len(records)} result(s) to {args.output} ({failed} failed)")
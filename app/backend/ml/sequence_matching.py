@@ -0,0 +1,322 @@
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import Config
+from ml.analyze_shot import KEY_JOINT_NAMES, calculate_joint_angles
+from ml.pose_features import pose_features
+from ml.pose_index import normalize_rows
+
+# Motion comparison with dynamic time warping. Frames are unit pose vectors,
+# as in ProPoseIndex, and the cost of matching two frames is their cosine
+# distance 1 - q.r, which for unit vectors equals |q - r|^2 / 2. Costs are
+# normalized by n + m so clips of different lengths are comparable.
+
+
+def sequence_features(landmarks):
+    return pose_features(landmarks)
+
+
+def resample_sequence(features, length):
+    # Linear interpolation in time to a fixed number of frames
+    count = len(features)
+    if count == length:
+        return features
+    positions = np.linspace(0, count - 1, length)
+    lower = np.floor(positions).astype(int)
+    upper = np.minimum(lower + 1, count - 1)
+    weight = (positions - lower)[:, np.newaxis]
+    return normalize_rows(features[lower] * (1 - weight) + features[upper] * weight)
+
+
+def band_width(n, m, band=None):
+    # Sakoe-Chiba band around the diagonal from the first to the last cell,
+    # at least wide enough that the bands of consecutive rows connect when
+    # the sequences differ in length
+    band = Config.DTW_BAND if band is None else band
+    if n == 1:
+        # A single query frame has to cover the whole reference
+        return max(m - 1, 1)
+    steps = (max(n, m) - 1) / max(min(n, m) - 1, 1)
+    return max(int(np.ceil(band * max(n, m))), int(np.ceil(steps / 2)), 1)
+
+
+def _band_columns(i, n, m, window):
+    center = i * (m - 1) / max(n - 1, 1)
+    return max(0, int(np.floor(center - window))), min(m - 1, int(np.ceil(center + window)))
+
+
+def dtw_distance(query, reference, window=None, abandon_above=np.inf):
+    # Banded DTW, one vectorized pass per query row. Within a row
+    #   D[i, j] = C[i, j] + min(A[j], D[i, j - 1]),  A[j] = min(D[i-1, j], D[i-1, j-1])
+    # unrolls to D[i, j] = S[j] + min_{k <= j}(A[k] - S[k - 1]) with S the
+    # running sum of the row's costs, i.e. a cumsum and a minimum.accumulate.
+    # Costs are non-negative, so once a whole row exceeds abandon_above the
+    # final distance will too and the computation stops early.
+    n, m = len(query), len(reference)
+    window = band_width(n, m) if window is None else window
+    limit = abandon_above * (n + m)
+    previous = np.full(m, np.inf)
+    for i in range(n):
+        lo, hi = _band_columns(i, n, m, window)
+        costs = np.maximum(1.0 - reference[lo : hi + 1] @ query[i], 0.0)
+        if i == 0:
+            reach = np.full(hi - lo + 1, np.inf)
+            reach[0] = 0.0 if lo == 0 else np.inf
+        else:
+            shifted = np.concatenate(([np.inf], previous[:-1]))
+            reach = np.minimum(previous[lo : hi + 1], shifted[lo : hi + 1])
+        running = np.cumsum(costs)
+        row = running + np.minimum.accumulate(reach - (running - costs))
+        previous = np.full(m, np.inf)
+        previous[lo : hi + 1] = row
+        if row.min() > limit:
+            return np.inf
+    return previous[m - 1] / (n + m)
+
+
+def dtw_path(query, reference, window=None):
+    # Full banded cost matrix with backtracking, for the single best match.
+    # Rows are filled with the same cumsum recurrence as dtw_distance.
+    n, m = len(query), len(reference)
+    window = band_width(n, m) if window is None else window
+    costs = np.maximum(1.0 - query @ reference.T, 0.0)
+    total = np.full((n + 1, m + 1), np.inf)
+    total[0, 0] = 0.0
+    for i in range(n):
+        lo, hi = _band_columns(i, n, m, window)
+        row_costs = costs[i, lo : hi + 1]
+        reach = np.minimum(total[i, lo + 1 : hi + 2], total[i, lo : hi + 1])
+        running = np.cumsum(row_costs)
+        total[i + 1, lo + 1 : hi + 2] = running + np.minimum.accumulate(
+            reach - (running - row_costs)
+        )
+
+    path = []
+    i, j = n, m
+    while i > 0 and j > 0:
+        path.append((i - 1, j - 1))
+        step = np.argmin((total[i - 1, j - 1], total[i - 1, j], total[i, j - 1]))
+        if step == 0:
+            i, j = i - 1, j - 1
+        elif step == 1:
+            i -= 1
+        else:
+            j -= 1
+    path.reverse()
+    return total[n, m] / (n + m), np.array(path), costs
+
+
+def keogh_envelopes(sequences, window):
+    # Running max / min over +-window frames for (S, L, d) sequences
+    padded = np.pad(sequences, ((0, 0), (window, window), (0, 0)), mode="edge")
+    windows = sliding_window_view(padded, 2 * window + 1, axis=1)
+    return windows.max(axis=-1), windows.min(axis=-1)
+
+
+def lb_keogh(query, upper, lower):
+    # Lower bound of dtw_distance for every reference at once: each query
+    # frame is matched to some reference frame inside its envelope
+    excess = np.maximum(query - upper, 0.0) + np.maximum(lower - query, 0.0)
+    length = query.shape[0]
+    return 0.5 * np.square(excess).sum(axis=(1, 2)) / (2 * length)
+
+
+class ProSequenceLibrary:
+    def __init__(self, length=None, band=None):
+        self.length = length or Config.DTW_RESAMPLE_LENGTH
+        self.window = band_width(self.length, self.length, band)
+        self.records = []
+        self.sequences = []
+        self._lock = threading.Lock()
+        self._resampled = None
+
+    def add_sequence(self, player, name, landmarks):
+        landmarks = np.asarray(landmarks, dtype=np.float32).reshape(-1, 33, 3)
+        if len(landmarks) < 2:
+            raise ValueError("A motion sequence needs at least two frames")
+        with self._lock:
+            self.records.append({"player": player, "name": name, "frames": len(landmarks)})
+            self.sequences.append(landmarks)
+            self._resampled = None
+
+    def _prepared(self):
+        # Resampled copies and their envelopes for LB_Keogh, built lazily
+        with self._lock:
+            if self._resampled is None and self.sequences:
+                resampled = np.stack(
+                    [resample_sequence(sequence_features(s), self.length) for s in self.sequences]
+                )
+                upper, lower = keogh_envelopes(resampled, self.window)
+                self._resampled = (resampled, upper, lower)
+            return self._resampled
+
+    def players(self):
+        return sorted({record["player"] for record in self.records})
+
+    def rank(self, user_landmarks, player=None, top_k=None):
+        # Best top_k pro sequences by DTW cost. Candidates are visited in
+        # order of their LB_Keogh bound; once the bound reaches the current
+        # k-th best cost no remaining candidate can enter the ranking.
+        top_k = top_k or Config.DTW_TOP_K
+        prepared = self._prepared()
+        if prepared is None:
+            return []
+        resampled, upper, lower = prepared
+        candidates = np.array(
+            [
+                i
+                for i, record in enumerate(self.records)
+                if player is None or record["player"].lower() == player.lower()
+            ],
+            dtype=int,
+        )
+        if not len(candidates):
+            return []
+
+        query = resample_sequence(sequence_features(user_landmarks), self.length)
+        bounds = lb_keogh(query, upper[candidates], lower[candidates])
+        best = []
+        for position in np.argsort(bounds):
+            threshold = best[-1][0] if len(best) >= top_k else np.inf
+            if bounds[position] >= threshold:
+                break
+            index = int(candidates[position])
+            cost = dtw_distance(query, resampled[index], self.window, threshold)
+            if cost < threshold:
+                best.append((cost, index))
+                best.sort()
+                del best[top_k:]
+        return [(float(cost), index) for cost, index in best]
+
+    def compare(self, user_landmarks, player=None, frame_indices=None, phases=None):
+        ranking = self.rank(user_landmarks, player)
+        if not ranking:
+            return None
+        best_cost, best_index = ranking[0]
+        record = self.records[best_index]
+        pro_landmarks = self.sequences[best_index]
+        user_landmarks = np.asarray(user_landmarks).reshape(-1, 33, 3)
+
+        # Alignment at full frame resolution for the per-phase and per-joint detail
+        _, path, costs = dtw_path(
+            sequence_features(user_landmarks), sequence_features(pro_landmarks)
+        )
+        path_costs = costs[path[:, 0], path[:, 1]]
+
+        return {
+            "player": record["player"],
+            "sequence": record["name"],
+            "cost": best_cost,
+            "phase_costs": phase_costs(path, path_costs, len(user_landmarks), frame_indices, phases),
+            "joint_trajectories": joint_trajectories(user_landmarks, pro_landmarks, path),
+            "ranking": [
+                {
+                    "player": self.records[index]["player"],
+                    "sequence": self.records[index]["name"],
+                    "cost": cost,
+                }
+                for cost, index in ranking
+            ],
+        }
+
+    def save(self, path):
+        # One concatenated float32 array, an offset table and JSON metadata,
+        # loadable without pickle
+        offsets = np.cumsum([0] + [len(s) for s in self.sequences])
+        landmarks = (
+            np.concatenate(self.sequences) if self.sequences else np.empty((0, 33, 3), np.float32)
+        )
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            landmarks=landmarks,
+            offsets=offsets,
+            records=np.array(json.dumps(self.records)),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        library = cls()
+        with np.load(path, allow_pickle=False) as data:
+            offsets = data["offsets"]
+            landmarks = data["landmarks"]
+            records = json.loads(str(data["records"]))
+        for i, record in enumerate(records):
+            library.add_sequence(
+                record["player"], record["name"], landmarks[offsets[i] : offsets[i + 1]]
+            )
+        return library
+
+
+def phase_costs(path, path_costs, user_length, frame_indices=None, phases=None):
+    # Mean alignment cost of the path cells whose user frame falls in each
+    # phase of the shot; a single "full" segment without detected phases
+    if not phases or frame_indices is None:
+        return {"full": float(path_costs.mean())}
+    frame_indices = np.asarray(frame_indices)
+    bounds = [
+        ("preparation", 0),
+        ("gather", int(np.searchsorted(frame_indices, phases["gather"]["frame"]))),
+        ("set_point", int(np.searchsorted(frame_indices, phases["set_point"]["frame"]))),
+        ("release", int(np.searchsorted(frame_indices, phases["release"]["frame"]))),
+    ]
+    segments = {}
+    for k, (name, start) in enumerate(bounds):
+        stop = bounds[k + 1][1] if k + 1 < len(bounds) else user_length
+        mask = (path[:, 0] >= start) & (path[:, 0] < stop)
+        if mask.any():
+            segments[name] = float(path_costs[mask].mean())
+    return segments
+
+
+def joint_trajectories(user_landmarks, pro_landmarks, path):
+    # Key joint angles per user frame, with the pro's angles averaged over the
+    # frames each user frame was aligned to
+    user_angles = calculate_joint_angles(user_landmarks)
+    pro_angles = calculate_joint_angles(pro_landmarks)[path[:, 1]]
+    counts = np.bincount(path[:, 0], minlength=len(user_angles))[:, np.newaxis]
+    aligned = np.zeros_like(user_angles)
+    np.add.at(aligned, path[:, 0], pro_angles)
+    aligned /= np.maximum(counts, 1)
+    return {
+        joint: {"user": user_angles[:, k].tolist(), "pro": aligned[:, k].tolist()}
+        for k, joint in enumerate(KEY_JOINT_NAMES)
+    }
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_sequence_library():
+    global _library
+    if _library is None:
+        with _library_lock:
+            if _library is None:
+                if os.path.exists(Config.PRO_SEQUENCE_FILE):
+                    _library = ProSequenceLibrary.load(Config.PRO_SEQUENCE_FILE)
+                else:
+                    _library = ProSequenceLibrary()
+    return _library
+
+
+if __name__ == "__main__":
+    # python ml/sequence_matching.py <player> <video> [<video> ...]
+    from ml.video_analysis import extract_video_landmarks
+
+    player, videos = sys.argv[1], sys.argv[2:]
+    library = get_sequence_library()
+    for video_path in videos:
+        frames = extract_video_landmarks(video_path, stride=1)
+        library.add_sequence(
+            player, os.path.basename(video_path), np.array([lm for _, lm in frames])
+        )
+        print(f"Added {len(frames)} frame(s) of {video_path} for {player}")
+    library.save(Config.PRO_SEQUENCE_FILE)
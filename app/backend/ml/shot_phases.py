@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+from config import Config
+from media_processing.image_processor import extract_pose_landmarks, get_scan_pose_pool
+from media_processing.landmark_cache import cached_frame_landmarks
+from media_processing.video_frames import iter_video_frames, read_video_info
+from ml.analyze_shot import calculate_angles_batch
+
+# Shooting arm, same side as KEY_JOINTS in analyze_shot
+SHOULDER, ELBOW, WRIST = 11, 13, 15
+
+
+def downscale(frame, width):
+    height, frame_width = frame.shape[:2]
+    if frame_width <= width:
+        return frame
+    scale = width / float(frame_width)
+    return cv2.resize(frame, (width, int(round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def scan_pose_track(video_path, scan_fps=None, scan_width=None):
+    # Coarse pose track: few frames per second and small frames, on the scan
+    # pool's PHASE_SCAN_MODEL_COMPLEXITY model (the bundled full model by
+    # default, 0 for lite). Landmarks are normalized to the frame, so
+    # downscaling does not change their coordinates.
+    scan_fps = scan_fps or Config.PHASE_SCAN_FPS
+    scan_width = scan_width or Config.PHASE_SCAN_WIDTH
+    pool = get_scan_pose_pool()
+    track = []
+    for i, frame in iter_video_frames(video_path, target_fps=scan_fps):
+        landmarks = extract_pose_landmarks(downscale(frame, scan_width), pool=pool)
+        if landmarks is not None:
+            track.append((i, landmarks))
+    return track
+
+
+def smooth(values, size=3):
+    if len(values) < size:
+        return values
+    padded = np.pad(values, size // 2, mode="edge")
+    return np.convolve(padded, np.ones(size) / size, mode="valid")
+
+
+def detect_shot_phases(frame_indices, landmarks, fps, frame_count):
+    # Image y grows downwards, so "higher" means a smaller y.
+    #   release:   highest wrist position of the clip, above the shoulder
+    #   set point: most bent elbow between the wrist rising above the shoulder
+    #              and the release
+    #   gather:    lowest wrist position in the PHASE_GATHER_SECONDS before the
+    #              set point
+    if len(frame_indices) < 3:
+        return None
+    frame_indices = np.asarray(frame_indices)
+    landmarks = np.asarray(landmarks).reshape(-1, 33, 3)
+    fps = fps or 30.0
+
+    wrist_y = smooth(landmarks[:, WRIST, 1])
+    shoulder_y = smooth(landmarks[:, SHOULDER, 1])
+    above = wrist_y < shoulder_y
+
+    release = int(np.argmin(wrist_y))
+    if not above[release]:
+        return None
+
+    rise = release
+    while rise > 0 and above[rise - 1]:
+        rise -= 1
+    elbow_angles = calculate_angles_batch(
+        landmarks[rise : release + 1, SHOULDER],
+        landmarks[rise : release + 1, ELBOW],
+        landmarks[rise : release + 1, WRIST],
+    )
+    set_point = rise + int(np.nanargmin(elbow_angles))
+
+    earliest = frame_indices[set_point] - Config.PHASE_GATHER_SECONDS * fps
+    candidates = np.flatnonzero(
+        (frame_indices >= earliest) & (np.arange(len(frame_indices)) <= set_point)
+    )
+    gather = int(candidates[np.argmax(wrist_y[candidates])])
+
+    padding = int(round(Config.PHASE_PADDING_SECONDS * fps))
+    start = max(0, int(frame_indices[gather]) - padding)
+    stop = int(frame_indices[release]) + padding + 1
+    if frame_count > 0:
+        stop = min(stop, frame_count)
+
+    def phase(position):
+        frame = int(frame_indices[position])
+        return {"frame": frame, "time": frame / fps}
+
+    return {
+        "gather": phase(gather),
+        "set_point": phase(set_point),
+        "release": phase(release),
+        "window": {"start": start, "stop": stop},
+    }
+
+
+def find_shot_phases(video_path, content_hash=None):
+    info = read_video_info(video_path)
+    options = {
+        "fps": Config.PHASE_SCAN_FPS,
+        "width": Config.PHASE_SCAN_WIDTH,
+        "complexity": Config.PHASE_SCAN_MODEL_COMPLEXITY,
+    }
+    track = cached_frame_landmarks(
+        content_hash, "shot-scan", options, lambda: scan_pose_track(video_path)
+    )
+    if not track:
+        return None
+    return detect_shot_phases(
+        [i for i, _ in track],
+        [landmarks for _, landmarks in track],
+        info["fps"],
+        info["frame_count"],
+    )
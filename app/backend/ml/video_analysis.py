@@ -0,0 +1,396 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from config import Config
+from media_processing.image_processor import (
+    VideoPoseTracker,
+    extract_pose_landmarks,
+    pose_roi,
+    warm_up_pose_pool,
+)
+from media_processing.landmark_cache import cached_frame_landmarks
+from media_processing.video_frames import (
+    iter_video_frames,
+    read_video_info,
+    sampling_stride,
+)
+from metrics import FRAMES_TOTAL, stage, timed_frames
+from ml.analyze_shot import (
+    KEY_JOINT_NAMES,
+    KEY_JOINT_POINTS,
+    analyze_user_shots_batch,
+    build_suggestions,
+    find_matching_player,
+    player_not_found,
+    score_landmarks_batch,
+)
+from ml.sequence_matching import get_sequence_library
+from ml.shot_phases import find_shot_phases
+
+logger = logging.getLogger(__name__)
+
+# "full": a dict per analyzed frame in frame_results (what the app reads);
+# "summary": per-joint statistics plus the best and worst frames;
+# "columns": summary plus per-frame values as parallel arrays
+RESPONSE_DETAILS = ("full", "summary", "columns")
+
+_frame_executor = None
+_frame_executor_workers = 0
+_frame_executor_lock = threading.Lock()
+
+
+def parse_sampling_options(form):
+    # Optional video sampling policy: a frame stride, a target fps or a cap on
+    # the number of analyzed frames, whether to segment the shot first and
+    # whether to compare the whole motion against pro clips, and how much
+    # per-frame detail the response carries (see RESPONSE_DETAILS)
+    options = {}
+    for key, cast in (("stride", int), ("target_fps", float), ("max_frames", int)):
+        value = form.get(key, "").strip()
+        if value:
+            try:
+                options[key] = cast(value)
+            except ValueError:
+                options[key] = None
+            # "not > 0" also rejects a NaN target_fps
+            if options[key] is None or not options[key] > 0 or options[key] == float("inf"):
+                kind = "a positive whole number" if cast is int else "a positive number"
+                raise ValueError(f"{key} must be {kind}")
+    for key in ("segment", "compare_motion"):
+        value = form.get(key, "").strip().lower()
+        if value:
+            options[key] = value == "true"
+    detail = form.get("detail", "").strip().lower()
+    if detail:
+        if detail not in RESPONSE_DETAILS:
+            raise ValueError(f"detail must be one of {', '.join(RESPONSE_DETAILS)}")
+        options["detail"] = detail
+    return options
+
+
+def extract_frame_landmarks(frames, tracking=None):
+    # frames yields (frame_index, BGR frame); returns [(frame_index, landmarks)]
+    if tracking is None:
+        tracking = Config.VIDEO_POSE_TRACKING
+    frames = timed_frames(frames, "decode")
+    if not tracking:
+        return _extract_frames_static(frames)
+    with VideoPoseTracker() as tracker:
+        return _extract_frames_tracked(frames, tracker)
+
+
+def _extract_frames_static(frames):
+    frame_landmarks = []
+    roi = None
+    for i, frame in frames:
+        try:
+            # Pose the decoded frame directly, no temporary image on disk, and
+            # only the region around the player found in the previous frame
+            landmarks = extract_pose_landmarks(frame, roi=roi)
+            roi = pose_roi(landmarks, frame.shape) if Config.POSE_ROI_CROP else None
+            if landmarks is None:
+                logger.debug("No pose landmarks found for frame %d", i)
+                FRAMES_TOTAL.inc(outcome="no_pose")
+                continue
+            frame_landmarks.append((i, landmarks))
+            FRAMES_TOTAL.inc(outcome="ok")
+        except Exception:
+            logger.exception("Error analyzing frame %d", i)
+            FRAMES_TOTAL.inc(outcome="error")
+    return frame_landmarks
+
+
+def _extract_frames_tracked(frames, tracker):
+    frame_landmarks = []
+    key_joints = np.unique(KEY_JOINT_POINTS)
+    for i, frame in frames:
+        try:
+            landmarks, visibility = tracker.process(frame, i)
+            if landmarks is None:
+                logger.debug("No pose landmarks found for frame %d", i)
+                FRAMES_TOTAL.inc(outcome="no_pose")
+                continue
+            if visibility[key_joints].mean() < Config.MIN_KEY_JOINT_VISIBILITY:
+                logger.debug("Key joints not visible enough in frame %d", i)
+                FRAMES_TOTAL.inc(outcome="low_visibility")
+                continue
+            frame_landmarks.append((i, landmarks))
+            FRAMES_TOTAL.inc(outcome="ok")
+        except Exception:
+            logger.exception("Error analyzing frame %d", i)
+            FRAMES_TOTAL.inc(outcome="error")
+    return frame_landmarks
+
+
+def extract_video_landmarks(video_path, stride=None, target_fps=None, max_frames=None):
+    return extract_frame_landmarks(
+        iter_video_frames(video_path, stride, target_fps, max_frames)
+    )
+
+
+def _extract_chunk(video_path, start, stop, step, tracking):
+    return extract_frame_landmarks(
+        iter_video_frames(video_path, stride=step, start=start, stop=stop), tracking
+    )
+
+
+def get_frame_executor(workers):
+    global _frame_executor, _frame_executor_workers
+    with _frame_executor_lock:
+        if _frame_executor is None or _frame_executor_workers != workers:
+            if _frame_executor is not None:
+                _frame_executor.shutdown(wait=False)
+            _frame_executor_workers = workers
+            _frame_executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context(Config.JOB_START_METHOD),
+                initializer=warm_up_pose_pool,
+            )
+        return _frame_executor
+
+
+def extract_video_landmarks_parallel(
+    video_path,
+    stride=None,
+    target_fps=None,
+    max_frames=None,
+    workers=None,
+    chunk_frames=None,
+):
+    # Split the clip into contiguous frame ranges and decode and pose each
+    # range in its own process. The sampling stride is fixed up front so the
+    # chunks pick exactly the frames a sequential pass would.
+    workers = workers or Config.VIDEO_PARALLEL_WORKERS
+    chunk_frames = chunk_frames or Config.VIDEO_CHUNK_FRAMES
+    info = read_video_info(video_path)
+    frame_count = info["frame_count"]
+    if workers <= 1 or frame_count <= 0:
+        return extract_video_landmarks(video_path, stride, target_fps, max_frames)
+
+    step = sampling_stride(info["fps"], frame_count, stride, target_fps, max_frames)
+    stop = frame_count
+    if max_frames:
+        stop = min(frame_count, int(max_frames) * step)
+    # Chunk boundaries on multiples of the stride so no chunk starts on a
+    # frame that is immediately grabbed and thrown away
+    chunk_frames = max(step, chunk_frames // step * step)
+
+    executor = get_frame_executor(workers)
+    futures = [
+        executor.submit(
+            _extract_chunk,
+            video_path,
+            start,
+            min(start + chunk_frames, stop),
+            step,
+            Config.VIDEO_POSE_TRACKING,
+        )
+        for start in range(0, stop, chunk_frames)
+    ]
+    frame_landmarks = []
+    for future in futures:
+        frame_landmarks.extend(future.result())
+    return frame_landmarks
+
+
+def extract_video_landmarks_cached(
+    video_path,
+    content_hash=None,
+    stride=None,
+    target_fps=None,
+    max_frames=None,
+    workers=None,
+    chunk_frames=None,
+):
+    def compute():
+        if (workers or Config.VIDEO_PARALLEL_WORKERS) > 1:
+            return extract_video_landmarks_parallel(
+                video_path, stride, target_fps, max_frames, workers, chunk_frames
+            )
+        return extract_video_landmarks(video_path, stride, target_fps, max_frames)
+
+    options = {
+        "stride": stride,
+        "target_fps": target_fps,
+        "max_frames": max_frames,
+        # Used by sampling_stride when neither stride nor target_fps is given
+        "default_stride": Config.VIDEO_FRAME_STRIDE,
+    }
+    return cached_frame_landmarks(content_hash, "video", options, compute)
+
+
+def extract_shot_window_landmarks(video_path, window, content_hash=None):
+    # Dense, full-quality pass limited to the detected shot
+    stride = Config.PHASE_DENSE_STRIDE
+
+    def compute():
+        return extract_frame_landmarks(
+            iter_video_frames(
+                video_path, stride=stride, start=window["start"], stop=window["stop"]
+            )
+        )
+
+    options = {
+        "start": window["start"],
+        "stop": window["stop"],
+        "stride": stride,
+    }
+    return cached_frame_landmarks(content_hash, "shot-window", options, compute)
+
+
+def score_video_landmarks(frame_landmarks, calculator, player, detail="full", fps=None):
+    if not frame_landmarks:
+        return {"error": "No valid frames could be analyzed in the video"}
+    if detail != "full":
+        return summarize_video_landmarks(frame_landmarks, calculator, player, detail, fps)
+
+    # Score every sampled frame in one vectorized batch
+    landmarks = np.array([landmarks for _, landmarks in frame_landmarks])
+    with stage("scoring"):
+        batch_result = analyze_user_shots_batch(landmarks, calculator, player)
+    if "error" in batch_result:
+        return batch_result
+    results = batch_result["results"]
+
+    # Aggregate results
+    valid_scores = [r['similarity_score'] for r in results if 'similarity_score' in r]
+    if not valid_scores:
+        return {"error": "No valid similarity scores found in the video analysis"}
+
+    final_result = {
+        "average_similarity_score": sum(valid_scores) / len(valid_scores),
+        "frame_results": results
+    }
+
+    return final_result
+
+
+def _series_stats(values, times):
+    # Trend is the least-squares slope over time, per second of video
+    stats = {
+        "mean": round(float(values.mean()), 4),
+        "min": round(float(values.min()), 4),
+        "max": round(float(values.max()), 4),
+        "trend": 0.0,
+    }
+    if len(values) > 1 and np.ptp(times) > 0:
+        stats["trend"] = round(float(np.polyfit(times, values, 1)[0]), 4)
+    return stats
+
+
+def _frame_summary(frame_index, similarity, diffs):
+    angle_differences = dict(zip(KEY_JOINT_NAMES, np.round(diffs, 4).tolist()))
+    return {
+        "frame": int(frame_index),
+        "similarity_score": round(float(similarity), 4),
+        "angle_differences": angle_differences,
+        "suggestions": build_suggestions(angle_differences),
+    }
+
+
+def summarize_video_landmarks(frame_landmarks, calculator, player, detail="summary", fps=None):
+    # Compact alternative to frame_results: per-joint statistics over the clip
+    # and the best and worst frames, built straight from the score arrays.
+    # detail="columns" adds the per-frame values as parallel arrays.
+    matching_player = find_matching_player(calculator, player)
+    if not matching_player:
+        return player_not_found(calculator, player)
+
+    frame_indices = np.array([i for i, _ in frame_landmarks])
+    landmarks = np.array([landmarks for _, landmarks in frame_landmarks])
+    with stage("scoring"):
+        similarities, angle_diffs = score_landmarks_batch(landmarks, calculator, matching_player)
+    times = frame_indices / fps if fps else frame_indices.astype(float)
+
+    mean_diffs = angle_diffs.mean(axis=0)
+    result = {
+        "player": matching_player,
+        "average_similarity_score": float(similarities.mean()),
+        "frame_count": len(frame_indices),
+        "similarity": _series_stats(similarities, times),
+        "joints": {
+            joint: _series_stats(angle_diffs[:, j], times) for j, joint in enumerate(KEY_JOINT_NAMES)
+        },
+        "suggestions": build_suggestions(dict(zip(KEY_JOINT_NAMES, mean_diffs.tolist()))),
+        "best_frame": _frame_summary(
+            frame_indices[similarities.argmax()],
+            similarities.max(),
+            angle_diffs[similarities.argmax()],
+        ),
+        "worst_frame": _frame_summary(
+            frame_indices[similarities.argmin()],
+            similarities.min(),
+            angle_diffs[similarities.argmin()],
+        ),
+    }
+    if detail == "columns":
+        columns = {
+            "frame": frame_indices.tolist(),
+            "similarity_score": np.round(similarities, 4).tolist(),
+        }
+        for j, joint in enumerate(KEY_JOINT_NAMES):
+            columns[joint] = np.round(angle_diffs[:, j], 4).tolist()
+        result["frames"] = columns
+    return result
+
+
+def process_video(
+    video_path,
+    calculator,
+    player,
+    stride=None,
+    target_fps=None,
+    max_frames=None,
+    workers=None,
+    chunk_frames=None,
+    content_hash=None,
+    segment=None,
+    compare_motion=None,
+    detail=None,
+):
+    try:
+        if detail is None:
+            detail = Config.VIDEO_RESPONSE_DETAIL
+        if segment is None:
+            segment = Config.VIDEO_SEGMENT_SHOT
+        if compare_motion is None:
+            compare_motion = Config.VIDEO_COMPARE_MOTION
+        # With segmentation, a cheap pass locates gather, set point and release
+        # and only that window is analyzed in full; without a detectable shot
+        # the regular sampling policy applies
+        phases = find_shot_phases(video_path, content_hash) if segment else None
+
+        if phases is not None:
+            frame_landmarks = extract_shot_window_landmarks(
+                video_path, phases["window"], content_hash
+            )
+        else:
+            frame_landmarks = extract_video_landmarks_cached(
+                video_path,
+                content_hash,
+                stride=stride,
+                target_fps=target_fps,
+                max_frames=max_frames,
+                workers=workers,
+                chunk_frames=chunk_frames,
+            )
+        fps = read_video_info(video_path)["fps"] if detail != "full" else None
+        result = score_video_landmarks(frame_landmarks, calculator, player, detail, fps)
+        if segment and "error" not in result:
+            result["phases"] = phases
+        if compare_motion and "error" not in result:
+            # DTW alignment of the analyzed frames against the pro clips
+            result["motion"] = get_sequence_library().compare(
+                np.array([landmarks for _, landmarks in frame_landmarks]),
+                player,
+                [i for i, _ in frame_landmarks],
+                phases,
+            )
+        return result
+    except Exception as e:
+        logger.exception("Error in process_video")
+        return {"error": f"An error occurred while processing the video: {str(e)}"}
+